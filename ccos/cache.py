@@ -0,0 +1,37 @@
+# Standard library
+import os
+from pathlib import Path
+
+CACHE_DIR_DEFAULT = os.path.join("~", ".cache", "ccos-scripts")
+
+
+def get_cache_dir(*parts):
+    """
+    Get the path to the on-disk cache directory, or to a subdirectory of it,
+    creating it if it does not exist yet. The location defaults to
+    ~/.cache/ccos-scripts and may be overridden with the CCOS_CACHE_DIR
+    environment variable.
+
+    @param parts: the names of the nested subdirectories, if any
+    @return: the path to the cache directory
+    """
+    cache_dir = Path(os.environ.get("CCOS_CACHE_DIR", CACHE_DIR_DEFAULT))
+    cache_dir = cache_dir.expanduser().joinpath(*parts)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def write_atomic(path, data):
+    """
+    Write the given bytes to the file at the given path. The data is written to
+    a temporary file which then replaces the target so that concurrent readers
+    never see a partially written file.
+
+    @param path: the path of the file to write
+    @param data: the bytes to write
+    """
+    path = Path(path)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "wb") as file_obj:
+        file_obj.write(data)
+    os.replace(temp_path, path)
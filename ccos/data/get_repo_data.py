@@ -1,55 +1,181 @@
 # Standard library
+import copy
+import json
 import logging
+import re
+from datetime import datetime
+from urllib.parse import quote
 
 # Third-party
 import emoji
-import yaml
-from github.GithubException import GithubException, UnknownObjectException
+from github.GithubException import UnknownObjectException
+from github.Repository import Repository
 
-CC_METADATA_FILE_NAME = ".cc-metadata.yml"
+# First-party/Local
+from ccos import snapshot
+from ccos.cache import get_cache_dir, write_atomic
+from ccos.gh_utils import GITHUB_ORGANIZATION, setup_github_gql_client
+from ccos.gql_batch import execute_aliased
+from ccos.metadata import get_cc_metadata
+
+FIELD_ROOT_ENTRIES = """
+    repository(owner: $owner, name: $name) {
+        object(expression: "HEAD:") {
+            ... on Tree {
+                entries {
+                    name
+                    type
+                }
+            }
+        }
+    }
+"""
+# Names of license files recognized by licensee, which GitHub uses to detect
+# licenses
+# https://github.com/licensee/licensee/blob/main/lib/licensee/project_files/license_file.rb
+LICENSE_FILE_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in [
+        r"(un)?licen[sc]e",
+        r"(un)?licen[sc]e\.(md|markdown|txt|html)",
+        r"copying",
+        r"copying\.(md|markdown|txt|html)",
+        r"(un)?licen[sc]e\.[^.]+",
+        r"copying\.[^.]+",
+        r"(un)?licen[sc]e[-_].+",
+        r"copying[-_].+",
+        r".+[-_](un)?licen[sc]e",
+        r".+[-_]copying",
+    ]
+]
 LOG = logging.root
+REPO_DATA_CACHE_FILE = "repos.json"
+# Bump whenever the repo data or the structure of the cache changes so that
+# caches written by older versions of the code are ignored
+REPO_DATA_CACHE_VERSION = 2
+VARIABLES_ROOT_ENTRIES = {"owner": "String!", "name": "String!"}
 
 
-def get_repositories(organization):
-    LOG.info("Getting CC's repos...")
-    repos = organization.get_repos()
-    return repos
+def get_license_file_name(entries):
+    """
+    Get the name of the license file among the entries of the root tree of a
+    repo. The name is only returned if a single file looks like a license
+    file: the one GitHub detected the license in cannot be told apart from
+    the others otherwise.
+    @param entries: the root tree entries from the GraphQL API
+    @return: the name of the license file (or None)
+    """
+    names = [
+        entry["name"]
+        for entry in entries
+        if entry["type"] == "blob"
+        and any(
+            pattern.fullmatch(entry["name"])
+            for pattern in LICENSE_FILE_PATTERNS
+        )
+    ]
+    if len(names) == 1:
+        return names[0]
+    return None
+
 
+def get_license_file_names(repo_names, github_gql_client=None):
+    """
+    Get the names of the license files of the given repos with batched
+    GraphQL queries.
+    @param repo_names: the names of the repos
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @return: the dict mapping repo names to the names of their license files
+        (None if it was not found or is ambiguous)
+    """
+    if not repo_names:
+        return {}
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    items = [
+        (repo_name, {"owner": GITHUB_ORGANIZATION, "name": repo_name})
+        for repo_name in repo_names
+    ]
+    results, failures = execute_aliased(
+        github_gql_client,
+        "query",
+        FIELD_ROOT_ENTRIES,
+        VARIABLES_ROOT_ENTRIES,
+        items,
+    )
+    for repo_name, messages in failures.items():
+        LOG.warning(
+            f"{repo_name}: unable to fetch root tree: {'; '.join(messages)}"
+        )
+    file_names = {}
+    for repo_name, repository in results.items():
+        tree = (repository or {}).get("object") or {}
+        file_names[repo_name] = get_license_file_name(tree.get("entries", []))
+    return file_names
 
-def get_repo_github_data(repo):
+
+def get_license_url(record, license_file_name, requester):
+    """
+    Get the URL of the license file of the given repo, as returned by the
+    REST API.
+    @param record: the snapshot record of the repo
+    @param license_file_name: the name of the license file (or None if it
+        was not found in the root tree or is ambiguous)
+    @param requester: the PyGithub requester of the REST client
+    @return: the URL of the license file (or None)
+    """
+    if license_file_name is None:
+        # Fall back on the REST API for licenses that were detected in
+        # unexpected places or among several license files
+        repo = Repository(requester, {}, record, completed=False)
+        try:
+            return repo.get_license().html_url
+        except UnknownObjectException:
+            return None
+    branch = quote(record["default_branch"], safe="/")
+    return f"{record['html_url']}/blob/{branch}/{quote(license_file_name)}"
+
+
+def get_repo_github_data(record, license_url):
+    """
+    Get the GitHub data of the given repo for repos.json.
+    @param record: the snapshot record of the repo
+    @param license_url: the URL of the license file of the repo (or None)
+    @return: the GitHub data dict
+    """
     LOG.info("Getting data for this repo...")
     repo_github_data = {
-        "id": repo.id,
-        "name": repo.name,
-        "url": repo.html_url,
+        "id": record["id"],
+        "name": record["name"],
+        "url": record["html_url"],
         "description": (
-            emoji.emojize(repo.description) if repo.description else ""
+            emoji.emojize(record["description"])
+            if record["description"]
+            else ""
         ),
-        "website": repo.homepage,
-        "language": repo.language,
-        "created": repo.created_at.isoformat(),
+        # The GraphQL API returns null for repos without a website, where
+        # the REST API returned an empty string
+        "website": record["homepage"] or "",
+        "language": record["language"],
+        "created": datetime.fromisoformat(record["created_at"]).isoformat(),
     }
-    try:
-        license = repo.get_license()
-    except UnknownObjectException:
-        license = None
-    if license:
+    license = record["license"]
+    if license and license_url:
         repo_github_data["license"] = {
-            "name": license.license.name,
-            "url": license.html_url,
+            "name": license["name"],
+            "url": license_url,
         }
     else:
         repo_github_data["license"] = None
     return repo_github_data
 
 
-def get_repo_cc_metadata(repo):
+def get_repo_cc_metadata(record, all_cc_metadata):
     LOG.info("Getting CC metadata for this repo...")
-    try:
-        cc_metadata_file = repo.get_contents(CC_METADATA_FILE_NAME)
-    except (UnknownObjectException, GithubException):
+    # The fetched metadata is shared, so it is copied before being modified
+    cc_metadata = copy.deepcopy(all_cc_metadata.get(record["name"]))
+    if not isinstance(cc_metadata, dict):
         return {}
-    cc_metadata = yaml.safe_load(cc_metadata_file.decoded_content)
     if "technologies" in cc_metadata:
         cc_metadata["technologies"] = [
             technology.strip()
@@ -58,27 +184,124 @@ def get_repo_cc_metadata(repo):
     return cc_metadata
 
 
-def get_repo_data_list(repos):
-    repo_data_list = []
+def get_repo_watermark(record):
+    """
+    Get the watermark of the given repo. Any change to the data of a repo
+    (its description, license, .cc-metadata.yml file, etc.) moves the time at
+    which it was last updated or pushed to.
+    @param record: the snapshot record of the repo
+    @return: the watermark (list of strings)
+    """
+    return [f"{record['updated_at']}", f"{record['pushed_at']}"]
+
+
+def load_repo_data_cache():
+    """
+    Load the repo data of the previous run from the on-disk cache. The cache
+    is discarded if it was written by another version of the code.
+    @return: the dict mapping repo names to their entries, each with the
+        watermark of the repo and its data (None if it was skipped)
+    """
+    cache_file = get_cache_dir("repo-data").joinpath(REPO_DATA_CACHE_FILE)
+    if not cache_file.exists():
+        return {}
+    with open(cache_file, "r") as file_obj:
+        cache = json.load(file_obj)
+    if cache.get("version") != REPO_DATA_CACHE_VERSION:
+        return {}
+    return cache["repos"]
+
+
+def store_repo_data_cache(entries):
+    """
+    Store the repo data of this run in the on-disk cache.
+    @param entries: the dict mapping repo names to their entries (see
+        load_repo_data_cache)
+    """
+    cache_file = get_cache_dir("repo-data").joinpath(REPO_DATA_CACHE_FILE)
+    cache = {"version": REPO_DATA_CACHE_VERSION, "repos": entries}
+    write_atomic(cache_file, json.dumps(cache).encode("utf-8"))
+
+
+def get_repo_data_list(records, requester, github_gql_client=None):
+    """
+    Get the data of all public engineering projects among the given repos.
+    Everything but the .cc-metadata.yml files and the names of the license
+    files is part of the organization snapshot; those are fetched with
+    batched GraphQL queries. The data of repos whose watermark did not move
+    since the previous run is reused from the on-disk cache, so only the
+    changed repos are fetched. Private repos are skipped altogether.
+    @param records: the snapshot records of the repos
+    @param requester: the PyGithub requester of the REST client
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @return: the list of repo data dicts, sorted by name
+    """
+    # Private repos are not part of the data. They are left out of the cache
+    # too, as it is persisted by the workflow
+    public = [record for record in records if not record["private"]]
+    cached_entries = load_repo_data_cache()
+    entries = {}
+    changed = []
+    for record in public:
+        watermark = get_repo_watermark(record)
+        entry = cached_entries.get(record["name"])
+        if entry is not None and entry["watermark"] == watermark:
+            entries[record["name"]] = entry
+        else:
+            changed.append(record)
+    LOG.info(
+        f"{len(changed)} of {len(public)} public repos changed since the"
+        " previous run"
+    )
+    if changed and github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+
+    all_cc_metadata = get_cc_metadata(
+        [record["name"] for record in changed],
+        github_gql_client,
+        oids={
+            record["name"]: record["ccos"]["cc_metadata_oid"]
+            for record in changed
+        },
+    )
+    license_file_names = get_license_file_names(
+        [record["name"] for record in changed if record["license"]],
+        github_gql_client,
+    )
+
     count = 1
-    total = repos.totalCount
-
-    for repo in repos:
-        LOG.info(f"Processing {count} of {total} – {repo.name}")
-        if not repo.private:
-            repo_cc_metadata = get_repo_cc_metadata(repo)
-            is_engineering_project = repo_cc_metadata.get(
-                "engineering_project", True
-            )
-            if is_engineering_project:
-                repo_github_data = get_repo_github_data(repo)
-                if "slack" not in repo_cc_metadata:
-                    repo_cc_metadata["slack"] = ""
-                repo_data = {**repo_github_data, **repo_cc_metadata}
-                repo_data_list.append(repo_data)
-            else:
-                LOG.info("Not an active engineering project, skipping")
+    total = len(changed)
+    for record in changed:
+        LOG.info(f"Processing {count} of {total} – {record['name']}")
+        repo_data = None
+        repo_cc_metadata = get_repo_cc_metadata(record, all_cc_metadata)
+        is_engineering_project = repo_cc_metadata.get(
+            "engineering_project", True
+        )
+        if is_engineering_project:
+            license_url = None
+            if record["license"]:
+                license_url = get_license_url(
+                    record,
+                    license_file_names.get(record["name"]),
+                    requester,
+                )
+            repo_github_data = get_repo_github_data(record, license_url)
+            if "slack" not in repo_cc_metadata:
+                repo_cc_metadata["slack"] = ""
+            repo_data = {**repo_github_data, **repo_cc_metadata}
+        else:
+            LOG.info("Not an active engineering project, skipping")
+        entries[record["name"]] = {
+            "watermark": get_repo_watermark(record),
+            "data": repo_data,
+        }
         count += 1
+    store_repo_data_cache(entries)
+
+    repo_data_list = [
+        entry["data"] for entry in entries.values() if entry["data"]
+    ]
     return sorted(repo_data_list, key=lambda k: k["name"].lower())
 
 
@@ -89,15 +312,14 @@ def get_repo_data_dict(repo_data_list):
 
 
 def get_repo_data(gh_org_cc):
-    repos = get_repositories(gh_org_cc)
-    repo_data_list = get_repo_data_list(repos)
+    LOG.info("Getting CC's repos...")
+    records = snapshot.get_snapshot()["repos"]
+    repo_data_list = get_repo_data_list(records, gh_org_cc.requester)
     data = get_repo_data_dict(repo_data_list)
     return data
 
 
 def get_repo_names(gh_org_cc):
-    repos = get_repositories(gh_org_cc)
-    names = []
-    for repo in repos:
-        names.append(repo.name)
-    return names
+    # The names are read from the organization snapshot, so no Repository
+    # objects are needed
+    return snapshot.get_repo_names()
@@ -1,39 +1,47 @@
 # Standard library
+import hashlib
 import json
 import logging
 import os
-from tempfile import TemporaryDirectory
 
 # Third-party
-import git
+from github import InputGitAuthor, InputGitTreeElement
 
 # First-party/Local
-from ccos.gh_utils import GITHUB_ORGANIZATION, get_credentials
+from ccos.gh_utils import (
+    GITHUB_ORGANIZATION,
+    gql_query,
+    setup_github_gql_client,
+    setup_github_rest_client,
+)
+from ccos.git_cache import worktree
 
+COMMIT_MESSAGE = "Syncing new data changes."
 GITHUB_REPO_NAME = "ccos-website-source"
 GIT_USER_EMAIL = "cc-creativecommons-github-io-bot@creativecommons.org"
 GIT_USER_NAME = "CC creativecommons.github.io Bot"
 JSON_FILE_DIR = "databags"
 LOG = logging.root
-
-
-def set_up_repo(git_working_dir):
-    github_username, github_token = get_credentials()
-    github_repo_url_with_credentials = (
-        f"https://{github_username}:{github_token}"
-        f"@github.com/{GITHUB_ORGANIZATION}/{GITHUB_REPO_NAME}.git"
-    )
-    if not os.path.isdir(git_working_dir):
-        LOG.info("Cloning repo...")
-        repo = git.Repo.clone_from(
-            url=github_repo_url_with_credentials, to_path=git_working_dir
-        )
-    else:
-        LOG.info("Setting up repo...")
-        repo = git.Repo(git_working_dir)
-    origin = repo.remotes.origin
-    LOG.info("Pulling latest code...")
-    origin.pull()
+QUERY_DATABAGS = f"""
+    query($owner: String!, $name: String!) {{
+        repository(owner: $owner, name: $name) {{
+            defaultBranchRef {{
+                name
+                target {{
+                    oid
+                }}
+            }}
+            object(expression: "HEAD:{JSON_FILE_DIR}") {{
+                ... on Tree {{
+                    entries {{
+                        name
+                        oid
+                    }}
+                }}
+            }}
+        }}
+    }}
+"""
 
 
 def set_up_git_user():
@@ -44,31 +52,134 @@ def set_up_git_user():
     os.environ["GIT_COMMITTER_EMAIL"] = GIT_USER_EMAIL
 
 
-def generate_json_file(git_working_dir, data, filename):
-    LOG.info("Generating JSON file...")
+def get_json_text(data):
+    return json.dumps(data, sort_keys=True, indent=4)
+
+
+def generate_json_file(git_working_dir, filename, text):
+    LOG.info(f"Generating {filename}...")
     json_filename = os.path.join(git_working_dir, JSON_FILE_DIR, filename)
     with open(json_filename, "w") as json_file:
-        json.dump(data, json_file, sort_keys=True, indent=4)
+        json_file.write(text)
     return json_filename
 
 
-def commit_and_push_changes(git_working_dir, json_filename):
-    repo = git.Repo(git_working_dir)
-    git_diff = repo.index.diff(None)
-    if git_diff:
-        repo.index.add(items=f"{json_filename}")
-        repo.index.commit(message="Syncing new data changes.")
+def commit_and_push_changes(repo, json_filenames):
+    # The git CLI is used rather than repo.index, as GitPython cannot read the
+    # index of sparse checkouts
+    if repo.git.status("--porcelain", "--", *json_filenames):
+        repo.git.add(*json_filenames)
+        repo.git.commit(message=COMMIT_MESSAGE)
         origin = repo.remotes.origin
         LOG.info("Pushing latest code...")
-        origin.push()
+        origin.push(repo.active_branch.name)
     else:
         LOG.info("No changes to push...")
 
 
-def push_data(data, filename):
-    with TemporaryDirectory() as temp_dir:
-        git_working_dir = os.path.join(temp_dir, GITHUB_REPO_NAME)
-        set_up_repo(git_working_dir)
+def get_blob_oid(text):
+    """
+    Get the OID git gives to a file with the given contents.
+    @param text: the contents of the file
+    @return: the hex SHA-1 of the blob
+    """
+    content = text.encode("utf-8")
+    header = f"blob {len(content)}\0".encode("ascii")
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def get_databags(github_gql_client):
+    """
+    Get the head of the default branch of the website repo, along with the
+    OIDs of the databags it contains, with a single GraphQL query.
+    @param github_gql_client: the GitHub GraphQL API client
+    @return: the name of the default branch, the OID of its head commit and
+        the dict mapping databag file names to their blob OIDs
+    """
+    LOG.info("Fetching databags...")
+    result = github_gql_client.execute(
+        gql_query(QUERY_DATABAGS),
+        variable_values={
+            "owner": GITHUB_ORGANIZATION,
+            "name": GITHUB_REPO_NAME,
+        },
+    )
+    repository = result["repository"]
+    tree = repository["object"] or {}
+    oids = {entry["name"]: entry["oid"] for entry in tree.get("entries", [])}
+    LOG.success("done.")
+    return (
+        repository["defaultBranchRef"]["name"],
+        repository["defaultBranchRef"]["target"]["oid"],
+        oids,
+    )
+
+
+def push_data_via_api(texts, branch_name, head_oid):
+    """
+    Commit the databags on top of the given commit of the default branch of
+    the website repo with the Git Data API, so that only the databags
+    themselves are transferred.
+    @param texts: the dict mapping databag file names to their contents
+    @param branch_name: the name of the default branch
+    @param head_oid: the OID of the head commit of the default branch
+    """
+    LOG.info("Committing via the GitHub API...")
+    github_client = setup_github_rest_client()
+    gh_repo = github_client.get_repo(
+        f"{GITHUB_ORGANIZATION}/{GITHUB_REPO_NAME}", lazy=True
+    )
+    base_commit = gh_repo.get_git_commit(head_oid)
+    tree = gh_repo.create_git_tree(
+        [
+            InputGitTreeElement(
+                f"{JSON_FILE_DIR}/{filename}", "100644", "blob", content=text
+            )
+            for filename, text in sorted(texts.items())
+        ],
+        base_commit.tree,
+    )
+    author = InputGitAuthor(GIT_USER_NAME, GIT_USER_EMAIL)
+    commit = gh_repo.create_git_commit(
+        COMMIT_MESSAGE, tree, [base_commit], author, author
+    )
+    # Not forced: fails rather than overwrite commits pushed in the meantime
+    gh_repo.get_git_ref(f"heads/{branch_name}").edit(commit.sha)
+    LOG.success(f"Pushed to {branch_name}.")
+
+
+def push_data(databags, clone=False, github_gql_client=None):
+    """
+    Push the given databags to the website repo in a single commit. The
+    databags are first compared to the blobs on the default branch, and
+    nothing is written if none of them changed. The changed ones are pushed
+    through the Git Data API or, with clone, with git from a sparse checkout
+    of the databags directory.
+    @param databags: the dict mapping databag file names to their data
+    @param clone: whether to push with git
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    """
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    branch_name, head_oid, oids = get_databags(github_gql_client)
+    texts = {}
+    for filename, data in databags.items():
+        text = get_json_text(data)
+        if oids.get(filename) != get_blob_oid(text):
+            texts[filename] = text
+    if not texts:
+        LOG.info("No changes to push...")
+        return
+    LOG.info(f"Changed databags: {', '.join(sorted(texts))}")
+    if not clone:
+        push_data_via_api(texts, branch_name, head_oid)
+        return
+    with worktree(
+        GITHUB_REPO_NAME, branch=branch_name, sparse_paths=[JSON_FILE_DIR]
+    ) as repo:
         set_up_git_user()
-        json_filename = generate_json_file(git_working_dir, data, filename)
-        commit_and_push_changes(git_working_dir, json_filename)
+        json_filenames = [
+            generate_json_file(repo.working_dir, filename, text)
+            for filename, text in sorted(texts.items())
+        ]
+        commit_and_push_changes(repo, json_filenames)
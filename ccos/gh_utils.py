@@ -17,6 +17,10 @@ from pygments.formatters import TerminalFormatter
 from pygments.lexers import GraphQLLexer
 from urllib3.util.retry import Retry
 
+# First-party/Local
+from ccos.gql_schema import validate_document
+from ccos.http_cache import set_up_connection
+
 GITHUB_ORGANIZATION = "creativecommons"
 GITHUB_RETRY_STATUS_FORCELIST = [
     408,  # Request Timeout
@@ -58,6 +62,20 @@ def gql_query(query):
             f"Invalid GraphQL syntax:\n{query_formatted}\n{error_formatted}"
         )
         sys.exit(1)
+    errors = validate_document(validated_query, query)
+    if errors:
+        query_formatted = highlight(
+            textwrap.indent(textwrap.dedent(query), "    "),
+            GraphQLLexer(),
+            TerminalFormatter(),
+        )
+        errors_formatted = textwrap.indent(
+            "\n".join(f"{error}" for error in errors), "    "
+        )
+        LOG.error(
+            f"Invalid GraphQL query:\n{query_formatted}\n{errors_formatted}"
+        )
+        sys.exit(1)
     return validated_query
 
 
@@ -72,13 +90,31 @@ def setup_github_gql_client():
         retry_backoff_factor=10,
         retry_status_forcelist=GITHUB_RETRY_STATUS_FORCELIST,
     )
-    with open("ccos/schema.docs.graphql") as file_obj:
-        gh_schema = file_obj.read()
-    github_gql_client = Client(transport=transport, schema=gh_schema)
+    # Documents are validated against the schema by gql_query() instead of by
+    # the client so that the (large) schema is only loaded when needed
+    github_gql_client = Client(transport=transport)
     return github_gql_client
 
 
-def setup_github_rest_client():
+def setup_github_gql_async_client():
+    # Imported here as the asynchronous transport (and aiohttp) is only
+    # required by scripts running in concurrent mode
+    # Third-party
+    from gql.transport.aiohttp import AIOHTTPTransport
+
+    _, github_token = get_credentials()
+    LOG.info("Setting up GitHub GraphQL API async client")
+    # Retries are handled by ccos.gql_batch.AdaptiveThrottle
+    transport = AIOHTTPTransport(
+        url="https://api.github.com/graphql",
+        headers={"Authorization": f"bearer {github_token}"},
+        timeout=10,
+    )
+    github_gql_client = Client(transport=transport)
+    return github_gql_client
+
+
+def setup_github_rest_client(pool_size=None, cache=None):
     _, github_token = get_credentials()
     LOG.info("Setting up GitHub Rest API client")
     # TODO: Remove retry parameter (urllib3.util.retry.Retry object) once we
@@ -100,7 +136,15 @@ def setup_github_rest_client():
             "TRACE",
         },
     )
-    github_rest_client = Github(login_or_token=github_token, retry=retry)
+    # pool_size is the number of connections kept open to the API, which
+    # should match the number of threads making requests concurrently
+    github_rest_client = Github(
+        login_or_token=github_token, retry=retry, pool_size=pool_size
+    )
+    # If the HTTP cache is enabled (see ccos.http_cache), GET requests are
+    # made conditional on the responses cached by previous runs so that
+    # unchanged resources do not count against the rate limit
+    set_up_connection(github_rest_client.requester, cache)
     return github_rest_client
 
 
@@ -123,9 +167,15 @@ def get_cc_organization(github_client=None):
 def get_select_repos(args, gh_org_cc=None):
     if gh_org_cc is None:
         gh_org_cc = get_cc_organization()
+    # Imported here as ccos.snapshot depends on this module
+    # First-party/Local
+    from ccos.snapshot import get_repos
+
     LOG.info("Get select GitHub repositories")
     LOG.change_indent(-1)
-    repos = list(gh_org_cc.get_repos())
+    # The repos are listed from the organization snapshot, which is shared by
+    # all steps (and scripts) run within a few minutes of each other
+    repos = get_repos(gh_org_cc.requester)
     LOG.change_indent(+1)
     # Skip archived repos
     repos_selected = []
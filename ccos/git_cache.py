@@ -0,0 +1,208 @@
+# Standard library
+import base64
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Third-party
+import git
+
+# First-party/Local
+from ccos.cache import get_cache_dir
+from ccos.gh_utils import GITHUB_ORGANIZATION, get_credentials
+
+# Mirrors are evicted, least recently used first, once their total size
+# exceeds this budget (in megabytes). May be overridden with the
+# CCOS_GIT_CACHE_BUDGET environment variable
+GIT_CACHE_BUDGET_DEFAULT = 1024
+LOG = logging.root
+
+
+def get_git_cache_dir():
+    """
+    Get the directory holding the bare mirrors. It defaults to the git
+    subdirectory of the cache directory and may be overridden with the
+    CCOS_GIT_CACHE_DIR environment variable.
+    @return: the path to the directory
+    """
+    if "CCOS_GIT_CACHE_DIR" in os.environ:
+        cache_dir = Path(os.environ["CCOS_GIT_CACHE_DIR"]).expanduser()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return cache_dir
+    return get_cache_dir("git")
+
+
+def get_git_cache_budget():
+    budget = os.environ.get("CCOS_GIT_CACHE_BUDGET", GIT_CACHE_BUDGET_DEFAULT)
+    return int(budget) * 1024 * 1024
+
+
+def get_git_environment():
+    """
+    Get the environment variables that authenticate git with GitHub. The
+    token is passed as configuration through the environment so that it is
+    never written to the cached repositories.
+    @return: the dict of environment variables
+    """
+    github_username, github_token = get_credentials()
+    credentials = base64.b64encode(
+        f"{github_username}:{github_token}".encode("utf-8")
+    ).decode("ascii")
+    return {
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": "http.https://github.com/.extraheader",
+        "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}",
+        "GIT_TERMINAL_PROMPT": "0",
+    }
+
+
+def get_size(path):
+    """
+    Get the disk usage of the given directory.
+    @param path: the path to the directory
+    @return: the total size of the files in bytes
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+
+@contextmanager
+def locked(mirror_path, blocking=True):
+    """
+    Hold an exclusive lock on the given mirror, so that processes sharing the
+    cache directory do not update it concurrently.
+    @param mirror_path: the path to the mirror
+    @param blocking: whether to wait for the lock if it is already held
+    @return: whether the lock was acquired (always True if blocking)
+    """
+    lock_path = mirror_path.with_name(f"{mirror_path.name}.lock")
+    operation = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    with open(lock_path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, operation)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_mirror(repo_name, mirror_path, environment):
+    """
+    Create the bare mirror of the given repo, or bring it up to date. Mirrors
+    are partial clones without any blob: blobs are only downloaded when a
+    worktree needs them, and are then kept in the mirror.
+    @param repo_name: the name of the repo
+    @param mirror_path: the path to the mirror
+    @param environment: the git environment (see get_git_environment)
+    @return: the GitPython Git command wrapper, running in the mirror
+    """
+    # The mirror is only used through git commands: git.Repo does not read
+    # the per-worktree configuration that sparse checkouts enable, and would
+    # then mistake the mirror for a non-bare repo
+    url = f"https://github.com/{GITHUB_ORGANIZATION}/{repo_name}.git"
+    if not mirror_path.exists():
+        LOG.info("Cloning repo into cache...")
+        cloner = git.Git()
+        cloner.update_environment(**environment)
+        cloner.clone("--bare", "--filter=blob:none", url, str(mirror_path))
+        mirror = git.Git(mirror_path)
+        mirror.update_environment(**environment)
+        # Bare clones do not track the remote branches by default
+        mirror.config("remote.origin.fetch", "+refs/heads/*:refs/heads/*")
+    else:
+        LOG.info("Fetching repo into cache...")
+        mirror = git.Git(mirror_path)
+        mirror.update_environment(**environment)
+        mirror.worktree("prune")
+        mirror.fetch("--filter=blob:none", "--prune", "origin")
+    return mirror
+
+
+def evict(keep):
+    """
+    Remove the least recently used mirrors until the cache fits in its
+    budget. Mirrors that are in use, i.e. whose lock is held, are skipped.
+    @param keep: the path to the mirror that must not be removed (the one
+        used by the caller)
+    """
+    budget = get_git_cache_budget()
+    mirrors = []
+    total = 0
+    for path in get_git_cache_dir().glob("*.git"):
+        size = get_size(path)
+        mirrors.append((path.stat().st_mtime, path, size))
+        total += size
+    for _, path, size in sorted(mirrors):
+        if total <= budget:
+            break
+        if path.name == keep.name:
+            continue
+        with locked(path, blocking=False) as acquired:
+            if not acquired:
+                LOG.info(
+                    f"Not evicting {path.name} from the git cache: in use"
+                )
+                continue
+            LOG.info(f"Evicting {path.name} from the git cache")
+            shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+@contextmanager
+def worktree(repo_name, branch=None, sparse_paths=None):
+    """
+    Check out the given repo in a temporary worktree of its cached bare
+    mirror. The mirror is refreshed first, which only transfers what changed
+    since the previous run. Commits made in the worktree are stored in the
+    mirror and can be pushed to origin as usual; the mirror's branches are
+    reset to those of origin by the next refresh.
+
+    @param repo_name: the name of the repo
+    @param branch: the branch to check out (defaults to the default branch)
+    @param sparse_paths: the directories to check out, if the checkout
+        should be limited to them (the blobs of the other files are then
+        never downloaded)
+    @return: the GitPython Repo instance of the worktree, set up to
+        authenticate with GitHub
+    """
+    environment = get_git_environment()
+    mirror_path = get_git_cache_dir().joinpath(f"{repo_name}.git")
+    with locked(mirror_path):
+        mirror = get_mirror(repo_name, mirror_path, environment)
+        if branch is None:
+            branch = mirror.symbolic_ref("--short", "HEAD")
+        worktree_path = tempfile.mkdtemp(prefix=f"{repo_name}-")
+        try:
+            LOG.info("Checking out worktree...")
+            if sparse_paths:
+                mirror.worktree(
+                    "add", "--force", "--no-checkout", worktree_path, branch
+                )
+            else:
+                mirror.worktree("add", "--force", worktree_path, branch)
+            local_repo = git.Repo(worktree_path)
+            local_repo.git.update_environment(**environment)
+            if sparse_paths:
+                local_repo.git.sparse_checkout("set", *sparse_paths)
+                local_repo.git.checkout()
+            yield local_repo
+        finally:
+            mirror.worktree("remove", "--force", worktree_path)
+            shutil.rmtree(worktree_path, ignore_errors=True)
+            os.utime(mirror_path)
+    evict(keep=mirror_path)
+
+
+__all__ = ["worktree"]
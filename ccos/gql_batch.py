@@ -0,0 +1,261 @@
+# Standard library
+import asyncio
+import logging
+import re
+
+# Third-party
+from gql.transport.exceptions import TransportQueryError, TransportServerError
+
+# First-party/Local
+from ccos.gh_utils import GITHUB_RETRY_STATUS_FORCELIST, gql_query
+
+# Each aliased field is a separate mutation or lookup. 50 keeps documents well
+# below GitHub's node limit (500,000) and, for mutations, keeps a single
+# request from costing more than a fraction of the secondary rate limit
+# budget.
+# https://docs.github.com/en/graphql/overview/rate-limits-and-node-limits-for-the-graphql-api
+BATCH_SIZE = 50
+# Secondary rate limits are signalled with 403 Forbidden (or 429)
+# https://docs.github.com/en/rest/using-the-rest-api/troubleshooting-the-rest-api#rate-limit-errors
+BACKOFF_STATUS_CODES = set(GITHUB_RETRY_STATUS_FORCELIST) | {403}
+BACKOFF_MIN = 5
+BACKOFF_MAX = 300
+BACKOFF_RETRIES = 5
+LOG = logging.root
+
+
+class AdaptiveThrottle:
+    """
+    Bound the number of concurrent asynchronous GraphQL requests and back off,
+    for all of them at once, whenever GitHub signals a rate limit (HTTP 403 or
+    429 responses or RATE_LIMITED errors) or a transient server error. The
+    shared delay doubles on each such response and halves on each successful
+    one.
+    """
+
+    def __init__(self, concurrency, retries=BACKOFF_RETRIES):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.delay = 0
+        self.resume_at = 0
+
+    def back_off(self, reason):
+        """
+        Double the shared delay and pause all requests for its duration.
+        @param reason: the reason for backing off (for the log)
+        """
+        self.delay = min(max(self.delay * 2, BACKOFF_MIN), BACKOFF_MAX)
+        resume_at = asyncio.get_running_loop().time() + self.delay
+        self.resume_at = max(self.resume_at, resume_at)
+        LOG.warning(f"{reason}: backing off for {self.delay} seconds")
+
+    async def execute(self, session, document, variable_values):
+        """
+        Execute the document once all pauses have passed, retrying it if it is
+        rejected because of a rate limit.
+
+        @param session: the gql async client session
+        @param document: the GraphQL document to execute
+        @param variable_values: the variable values for the document
+        @return: the data and the list of GraphQL errors (or None)
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            retry = attempt < self.retries
+            async with self.semaphore:
+                while loop.time() < self.resume_at:
+                    await asyncio.sleep(self.resume_at - loop.time())
+                try:
+                    data = await session.execute(
+                        document, variable_values=variable_values
+                    )
+                    errors = None
+                except TransportServerError as e:
+                    if not retry or e.code not in BACKOFF_STATUS_CODES:
+                        raise
+                    self.back_off(f"HTTP {e.code}")
+                    continue
+                except TransportQueryError as e:
+                    if retry and is_rate_limited(e.errors):
+                        self.back_off("GraphQL API rate limit")
+                        continue
+                    data = e.data
+                    errors = e.errors
+            self.delay //= 2
+            return data, errors
+
+
+def is_rate_limited(errors):
+    """
+    Determine whether the GraphQL errors indicate a rate limit.
+    @param errors: the list of GraphQL errors
+    @return: whether any of the errors is a rate limit error
+    """
+    return any(error.get("type") == "RATE_LIMITED" for error in errors or [])
+
+
+def chunked(items, size=BATCH_SIZE):
+    """
+    Split the given list into consecutive chunks of (at most) the given size.
+
+    @param items: the list to split
+    @param size: the maximum number of items per chunk
+    @return: the list of chunks
+    """
+    return [
+        items[i : i + size] for i in range(0, len(items), size)  # noqa: E203
+    ]
+
+
+def build_aliased_document(operation, field, variables, items):
+    """
+    Build a GraphQL document that repeats the given field once per item, each
+    under its own alias and with its own set of variables.
+
+    Example field (with variables {"login": "String!"}):
+        user(login: $login) { id }
+
+    @param operation: the operation type ("query" or "mutation")
+    @param field: the field, including its selection set, to repeat. Variables
+        are referenced as $name
+    @param variables: the dict mapping variable names to their GraphQL types
+    @param items: the list of (key, params) pairs in which params maps each
+        variable name to its value for that item
+    @return: the document source, the variable values and the dict mapping
+        each alias to its item key
+    """
+    definitions = []
+    selections = []
+    values = {}
+    aliases = {}
+    for index, (key, params) in enumerate(items):
+        alias = f"item{index}"
+        aliases[alias] = key
+        for name, type_ in variables.items():
+            definitions.append(f"${name}_{index}: {type_}")
+            values[f"{name}_{index}"] = params[name]
+
+        def suffixed(match):
+            if match.group(1) in variables:
+                return f"${match.group(1)}_{index}"
+            return match.group(0)
+
+        selection = re.sub(r"\$(\w+)", suffixed, field.strip())
+        selections.append(f"{alias}: {selection}")
+    source = "\n".join(
+        [f"{operation}({', '.join(definitions)}) {{", *selections, "}"]
+    )
+    return source, values, aliases
+
+
+def parse_aliased_result(aliases, data, errors):
+    """
+    Map the (possibly partial) result of an aliased document back to the keys
+    of the items it was built from.
+
+    @param aliases: the dict mapping each alias to its item key
+    @param data: the data returned by the API (may be None)
+    @param errors: the list of GraphQL errors returned by the API (may be None)
+    @return: the dict mapping keys to their results and the dict mapping keys
+        to the list of error messages for the items that failed
+    """
+    data = data or {}
+    failures = {}
+    batch_errors = []
+    for error in errors or []:
+        message = error.get("message", f"{error}")
+        path = error.get("path") or []
+        if path and path[0] in aliases:
+            failures.setdefault(aliases[path[0]], []).append(message)
+        else:
+            batch_errors.append(message)
+    results = {}
+    for alias, key in aliases.items():
+        if key in failures:
+            continue
+        if batch_errors and data.get(alias) is None:
+            failures[key] = batch_errors
+        else:
+            results[key] = data.get(alias)
+    return results, failures
+
+
+def execute_aliased(
+    github_gql_client, operation, field, variables, items, size=BATCH_SIZE
+):
+    """
+    Execute the given field once per item, packing up to size items into each
+    request as aliased fields of a single document. A failure of one item does
+    not affect the others.
+
+    @param github_gql_client: the GitHub GraphQL API client
+    @param operation: the operation type ("query" or "mutation")
+    @param field: the field to repeat (see build_aliased_document)
+    @param variables: the dict mapping variable names to their GraphQL types
+    @param items: the list of (key, params) pairs (see build_aliased_document)
+    @param size: the maximum number of items per request
+    @return: the dict mapping keys to their results and the dict mapping keys
+        to the list of error messages for the items that failed
+    """
+    results = {}
+    failures = {}
+    for chunk in chunked(items, size):
+        source, values, aliases = build_aliased_document(
+            operation, field, variables, chunk
+        )
+        document = gql_query(source)
+        try:
+            data = github_gql_client.execute(document, variable_values=values)
+            errors = None
+        except TransportQueryError as e:
+            data = e.data
+            errors = e.errors
+        chunk_results, chunk_failures = parse_aliased_result(
+            aliases, data, errors
+        )
+        results.update(chunk_results)
+        failures.update(chunk_failures)
+    return results, failures
+
+
+async def execute_aliased_async(
+    session,
+    throttle,
+    operation,
+    field,
+    variables,
+    items,
+    size=BATCH_SIZE,
+):
+    """
+    Asynchronous variant of execute_aliased. Requests for the chunks of items
+    are sent concurrently, bounded by the throttle.
+
+    @param session: the gql async client session
+    @param throttle: the AdaptiveThrottle shared by all requests
+    @param operation: the operation type ("query" or "mutation")
+    @param field: the field to repeat (see build_aliased_document)
+    @param variables: the dict mapping variable names to their GraphQL types
+    @param items: the list of (key, params) pairs (see build_aliased_document)
+    @param size: the maximum number of items per request
+    @return: the dict mapping keys to their results and the dict mapping keys
+        to the list of error messages for the items that failed
+    """
+
+    async def execute_chunk(chunk):
+        source, values, aliases = build_aliased_document(
+            operation, field, variables, chunk
+        )
+        document = gql_query(source)
+        data, errors = await throttle.execute(session, document, values)
+        return parse_aliased_result(aliases, data, errors)
+
+    chunk_results = await asyncio.gather(
+        *[execute_chunk(chunk) for chunk in chunked(items, size)]
+    )
+    results = {}
+    failures = {}
+    for chunk_result, chunk_failures in chunk_results:
+        results.update(chunk_result)
+        failures.update(chunk_failures)
+    return results, failures
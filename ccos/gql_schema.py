@@ -0,0 +1,106 @@
+# Standard library
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+
+# Third-party
+from graphql import build_ast_schema, build_client_schema, parse, validate
+from graphql.utilities import introspection_from_schema
+
+# First-party/Local
+from ccos.cache import get_cache_dir, write_atomic
+
+LOG = logging.root
+SCHEMA_PATH = Path(__file__).resolve().parent.joinpath("schema.docs.graphql")
+VALIDATED_LOCK = threading.Lock()
+
+
+@functools.cache
+def get_schema_hash():
+    """
+    Get the hash of the GitHub GraphQL API schema definition (SDL) file. All
+    cached data derived from the schema is keyed by this hash so that it is
+    invalidated whenever the schema file is updated.
+
+    @return: the hexadecimal SHA-256 digest of the schema file
+    """
+    with open(SCHEMA_PATH, "rb") as file_obj:
+        return hashlib.sha256(file_obj.read()).hexdigest()
+
+
+def get_schema_cache_dir():
+    return get_cache_dir("graphql", get_schema_hash()[:16])
+
+
+@functools.cache
+def get_schema():
+    """
+    Get the GitHub GraphQL API schema. Building the schema from the 1.2 MB SDL
+    file is slow, so the first build is stored as compressed introspection JSON
+    from which subsequent runs rebuild the schema.
+
+    @return: the GraphQLSchema instance
+    """
+    cache_file = get_schema_cache_dir().joinpath("introspection.json.gz")
+    if cache_file.exists():
+        LOG.debug("Loading GitHub GraphQL schema from cache")
+        with gzip.open(cache_file, "rt") as file_obj:
+            introspection = json.load(file_obj)
+        return build_client_schema(introspection)
+
+    LOG.debug("Building GitHub GraphQL schema from SDL")
+    with open(SCHEMA_PATH, "r") as file_obj:
+        schema = build_ast_schema(parse(file_obj.read()))
+    introspection = introspection_from_schema(schema)
+    write_atomic(
+        cache_file,
+        gzip.compress(
+            json.dumps(introspection).encode("utf-8"), compresslevel=1
+        ),
+    )
+    return schema
+
+
+@functools.cache
+def load_validated_digests():
+    """
+    Load the digests of all GraphQL documents previously validated against the
+    current schema.
+
+    @return: the set of hexadecimal SHA-256 digests
+    """
+    digest_file = get_schema_cache_dir().joinpath("validated.json")
+    if not digest_file.exists():
+        return set()
+    with open(digest_file, "r") as file_obj:
+        return set(json.load(file_obj))
+
+
+def validate_document(document, source):
+    """
+    Validate the GraphQL document against the GitHub schema. Documents that
+    have already passed validation against the same schema are skipped, which
+    means the schema is only loaded when a new or modified document is seen.
+
+    @param document: the parsed GraphQL document (DocumentNode)
+    @param source: the source text from which the document was parsed
+    @return: the list of validation errors (empty if the document is valid)
+    """
+    digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    validated_digests = load_validated_digests()
+    if digest in validated_digests:
+        return []
+    errors = validate(get_schema(), document)
+    if not errors:
+        with VALIDATED_LOCK:
+            validated_digests.add(digest)
+            digest_file = get_schema_cache_dir().joinpath("validated.json")
+            write_atomic(
+                digest_file,
+                json.dumps(sorted(validated_digests)).encode("utf-8"),
+            )
+    return errors
@@ -0,0 +1,285 @@
+# Standard library
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import partial
+
+# Third-party
+import requests
+from github.Requester import HTTPSRequestsConnectionClass, RequestsResponse
+from requests.structures import CaseInsensitiveDict
+
+# First-party/Local
+from ccos.cache import get_cache_dir
+
+CACHE_FILE_NAME = "github-rest.sqlite"
+# Entries that have not been used for this many days are removed
+CACHE_MAX_AGE_DAYS = 30
+# The cache is disabled unless this environment variable is set to 1. It is
+# not persisted by the workflows, as it holds response bodies fetched with the
+# admin token, so it only pays off for runs on a workstation
+HTTP_CACHE_ENV = "CCOS_HTTP_CACHE"
+LOG = logging.root
+# The HttpCache shared by the clients of this process (see get_http_cache)
+HTTP_CACHE = {}
+
+
+class HttpCache:
+    """
+    Persistent store of the GitHub REST API responses that carry an ETag or
+    Last-Modified validator, kept in a SQLite database in the cache directory.
+    Cached responses are never served without being revalidated: the
+    validators are sent along with the next request for the same resource and
+    the cached response is only used if the API answers 304 Not Modified,
+    which does not count against the primary rate limit.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = get_cache_dir("http").joinpath(CACHE_FILE_NAME)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        expiry = time.time() - CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+        self.connection.execute(
+            "DELETE FROM responses WHERE accessed < ?", (expiry,)
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(url, headers):
+        """
+        Get the cache key of a request. Responses depend on the media type
+        and on the permissions of the token, so both are part of the key.
+        @param url: the URL of the request
+        @param headers: the headers of the request
+        @return: the hexadecimal SHA-256 digest identifying the request
+        """
+        parts = [
+            url,
+            headers.get("Accept", ""),
+            headers.get("Authorization", ""),
+        ]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Get the cached response for the given key.
+        @param key: the cache key (see get_key)
+        @return: the tuple of ETag, Last-Modified, headers (dict) and body
+            (bytes), or None if no response is cached
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT etag, last_modified, headers, body FROM responses"
+                " WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, headers, body = row
+        return etag, last_modified, json.loads(headers), body
+
+    def put(self, key, etag, last_modified, headers, body):
+        """
+        Store the response for the given key, replacing any previous one.
+        @param key: the cache key (see get_key)
+        @param etag: the ETag of the response (or None)
+        @param last_modified: the Last-Modified date of the response (or None)
+        @param headers: the headers of the response (dict)
+        @param body: the body of the response (bytes)
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    etag,
+                    last_modified,
+                    json.dumps(headers),
+                    body,
+                    time.time(),
+                ),
+            )
+            self.connection.commit()
+
+    def touch(self, key):
+        """
+        Mark the cached response for the given key as used.
+        @param key: the cache key (see get_key)
+        """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self.connection.commit()
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def log_stats(self):
+        """
+        Log the number of cache hits (304 Not Modified responses) and misses.
+        """
+        total = self.hits + self.misses
+        if total == 0:
+            return
+        LOG.info(
+            f"GitHub REST API cache: {self.hits} hits, {self.misses} misses"
+            f" ({self.hits / total:.0%} of {total} GET requests not counted"
+            " against the rate limit)"
+        )
+
+
+def get_cached_response(cached, response):
+    """
+    Build the response to return for a 304 Not Modified answer from the cached
+    response. The headers of the fresh answer (rate limit, etc.) take
+    precedence over the cached ones.
+    @param cached: the cached entry (see HttpCache.get)
+    @param response: the 304 Not Modified requests.Response
+    @return: the requests.Response to use in place of the 304
+    """
+    _, _, headers, body = cached
+    headers = CaseInsensitiveDict(headers)
+    headers.update(response.headers)
+    # The content of the cached response was not re-sent
+    for name in ["Content-Length", "Content-Encoding"]:
+        headers.pop(name, None)
+    replay = requests.Response()
+    replay.status_code = 200
+    replay.headers = headers
+    replay._content = body
+    replay.encoding = "utf-8"
+    replay.url = response.url
+    replay.request = response.request
+    return replay
+
+
+class CachingHTTPSRequestsConnectionClass(HTTPSRequestsConnectionClass):
+    """
+    PyGithub connection class which, if it is given a cache, makes GET
+    requests conditional on the validators of the cached response, if any,
+    and replays the cached response when the API answers 304 Not Modified.
+
+    PyGithub shares one connection between all threads and passes each
+    request from request() to getresponse() through attributes of the
+    connection, so the request is kept in thread-local storage instead to
+    allow concurrent requests. Streamed requests (file downloads) are passed
+    on as such and are not cached, as caching requires reading the body.
+    """
+
+    def __init__(self, *args, cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.local = threading.local()
+
+    def request(self, verb, url, input, headers, stream=False):
+        self.local.request = (verb, url, input, headers, stream)
+
+    def getresponse(self):
+        verb, path, input, headers, stream = self.local.request
+        url = f"{self.protocol}://{self.host}:{self.port}{path}"
+        key = None
+        cached = None
+        if verb == "GET" and not stream and self.cache is not None:
+            key = self.cache.get_key(url, headers)
+            cached = self.cache.get(key)
+        if cached is not None:
+            etag, last_modified, _, _ = cached
+            headers = dict(headers)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        response = self.session.request(
+            verb,
+            url,
+            headers=headers,
+            data=input,
+            timeout=self.timeout,
+            verify=self.verify,
+            allow_redirects=False,
+            stream=stream,
+        )
+        if key is None:
+            return RequestsResponse(response)
+
+        if response.status_code == 304 and cached is not None:
+            self.cache.record(hit=True)
+            self.cache.touch(key)
+            return RequestsResponse(get_cached_response(cached, response))
+        self.cache.record(hit=False)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            self.cache.put(
+                key,
+                etag,
+                last_modified,
+                dict(response.headers),
+                response.content,
+            )
+        return RequestsResponse(response)
+
+
+def is_http_cache_enabled():
+    return os.environ.get(HTTP_CACHE_ENV) == "1"
+
+
+def get_http_cache():
+    """
+    Get the HttpCache shared by the clients of this process, opening it on
+    first use.
+    @return: the HttpCache instance
+    """
+    if "cache" not in HTTP_CACHE:
+        cache = HttpCache()
+        atexit.register(cache.log_stats)
+        HTTP_CACHE["cache"] = cache
+    return HTTP_CACHE["cache"]
+
+
+def set_up_connection(requester, cache=None):
+    """
+    Make the given PyGithub requester use CachingHTTPSRequestsConnectionClass
+    for its requests to the API. Only this requester is affected: PyGithub
+    only allows replacing its connection classes globally, so the class is
+    set on the requester itself.
+    @param requester: the PyGithub requester of the REST client
+    @param cache: whether to cache responses (defaults to whether the
+        CCOS_HTTP_CACHE environment variable is set to 1). If False, only
+        the thread-safe connection handling is used
+    """
+    if cache is None:
+        cache = is_http_cache_enabled()
+    requester._Requester__connectionClass = partial(
+        CachingHTTPSRequestsConnectionClass,
+        cache=get_http_cache() if cache else None,
+    )
+
+
+__all__ = ["set_up_connection"]
@@ -1,6 +1,8 @@
 # Standard library
-import inspect
 import logging
+import sys
+import threading
+from contextlib import contextmanager
 
 SUCCESS = logging.INFO + 1
 
@@ -10,6 +12,13 @@ class IndentFormatter(logging.Formatter):
     Format the given log messages with proper indentation based on the stack
     depth of the code invoking the logger. This removes the need for manual
     indentation using tab characters.
+
+    The stack is walked via ``sys._getframe`` instead of ``inspect.stack`` as
+    the latter builds ``FrameInfo`` objects and stats source files for every
+    frame on every record.
+
+    The baseline and the manual push are tracked per thread so that worker
+    threads (see ``bind_thread``) can be indented independently.
     """
 
     # https://en.wikipedia.org/wiki/ANSI_escape_code
@@ -47,32 +56,102 @@ class IndentFormatter(logging.Formatter):
         fmt = "%(message)s"
         super().__init__(fmt=fmt)
 
+        self.local = threading.local()
         self.baseline = None
         self.cut = None
         self.manual_push = 0
+        self.formats = {}
 
-    def update_format(self, record):
+    @property
+    def baseline(self):
+        return getattr(self.local, "baseline", None)
+
+    @baseline.setter
+    def baseline(self, value):
+        self.local.baseline = value
+
+    @property
+    def manual_push(self):
+        return getattr(self.local, "manual_push", 0)
+
+    @manual_push.setter
+    def manual_push(self, value):
+        self.local.manual_push = value
+
+    @staticmethod
+    def get_depth(frame):
         """
-        Update the format string based on the log level of the record.
-        @param record: the record based on whose level to update the formatting
+        Get the number of frames on the stack, from the given frame outwards.
+        @param frame: the innermost frame from which to count
+        @return: the stack depth
+        """
+        depth = 0
+        while frame is not None:
+            depth += 1
+            frame = frame.f_back
+        return depth
+
+    @staticmethod
+    def get_filenames(frame):
+        """
+        Get the names of the files of all the frames on the stack, starting
+        from the given frame and moving outwards.
+        @param frame: the innermost frame from which to start
+        @return: the list of filenames, innermost first
+        """
+        filenames = []
+        while frame is not None:
+            filenames.append(frame.f_code.co_filename)
+            frame = frame.f_back
+        return filenames
+
+    def get_format(self, levelno, has_function):
+        """
+        Get the format string for the given log level, building and caching it
+        on first use.
+        @param levelno: the log level for which to get the format string
+        @param has_function: whether the name of the invoking function is shown
+        @return: the format string
+        """
+        key = (levelno, has_function)
+        if key not in self.formats:
+            self.formats[key] = self.build_format(levelno, has_function)
+        return self.formats[key]
+
+    def build_format(self, levelno, has_function):
+        """
+        Build the format string based on the log level of the record.
+        @param levelno: the log level for which to build the format string
+        @param has_function: whether the name of the invoking function is shown
+        @return: the format string
         """
         prefix = "\u001b["
-        color = f"{prefix}{self.color_map[record.levelno]}m"
+        color = f"{prefix}{self.color_map[levelno]}m"
         bold = f"{prefix}1m"
         gray = f"{prefix}1m{prefix}30m"
         reset = f"{prefix}0m"
-        self._style._fmt = (
+        fmt = (
             f"%(asctime)s"
             f" {gray}│{reset} {color}%(levelname)-8s{reset} {gray}│{reset} "
         )
-        if hasattr(record, "function"):
-            self._style._fmt += (
+        if has_function:
+            fmt += (
                 f"{gray}%(indent)s{reset}"
                 f"{bold}%(function)s{reset}{gray}:{reset}"
                 " %(message)s"
             )
         else:
-            self._style._fmt += "%(indent)s%(message)s"
+            fmt += "%(indent)s%(message)s"
+        return fmt
+
+    def update_format(self, record):
+        """
+        Update the format string based on the log level of the record.
+        @param record: the record based on whose level to update the formatting
+        """
+        self._style._fmt = self.get_format(
+            record.levelno, hasattr(record, "function")
+        )
 
     def format(self, record):
         """
@@ -80,18 +159,27 @@ class IndentFormatter(logging.Formatter):
         @param record: the log record to format with this formatter
         @return: the formatted log record
         """
-        stack = inspect.stack(context=0)
-        depth = len(stack)
+        frame = sys._getframe()
+        if self.cut is None:
+            self.cut = self.identify_cut(self.get_filenames(frame))
+
+        # Walk the stack once, counting frames and picking out the name of the
+        # function found at the cut
+        cut = self.cut
+        depth = 0
+        function = None
+        while frame is not None:
+            if depth == cut:
+                function = frame.f_code.co_name
+            depth += 1
+            frame = frame.f_back
         if self.baseline is None:
             self.baseline = depth
-        if self.cut is None:
-            filenames = map(lambda x: x.filename, stack)
-            self.cut = self.identify_cut(filenames)
 
         # Inject custom information into the record
         record.indent = "." * (depth - self.baseline + self.manual_push)
-        if depth > self.cut:
-            record.function = stack[self.cut].function
+        if function is not None:
+            record.function = function
 
         # Format the record using custom information
         self.update_format(record)
@@ -112,6 +200,46 @@ class IndentFormatter(logging.Formatter):
         """
         self.manual_push += delta
 
+    @contextmanager
+    def indented(self, delta=1):
+        """
+        Indent the logs by the given number of steps for the duration of the
+        context, de-indenting them again on exit.
+        @param delta: the number of steps by which to indent the logs
+        """
+        self.delta_indent(delta)
+        try:
+            yield
+        finally:
+            self.delta_indent(-delta)
+
+    def get_level(self, frame):
+        """
+        Get the indentation level of logs emitted from the given frame of the
+        current thread (without the frames of the logging module itself).
+        @param frame: the frame whose indentation level to get
+        @return: the indentation level
+        """
+        if self.baseline is None:
+            return self.manual_push
+        return self.get_depth(frame) - self.baseline + self.manual_push
+
+    def bind_thread(self, level, frame):
+        """
+        Indent the logs of the current thread so that the logs of functions
+        called from the given frame line up with the logs of functions called
+        from a frame at the given indentation level (generally captured with
+        get_level in the thread that started the current one).
+        @param level: the indentation level to continue from
+        @param frame: the frame of the current thread which corresponds to the
+            frame at the given level
+        @return: the previous baseline and manual push, for restoring them
+        """
+        previous = (self.baseline, self.manual_push)
+        self.baseline = self.get_depth(frame) - level
+        self.manual_push = 0
+        return previous
+
     def reset(self):
         """
         Reset the baseline and cut attributes so that the next call to the
@@ -122,6 +250,64 @@ class IndentFormatter(logging.Formatter):
         self.manual_push = 0
 
 
+class ThreadBufferedStream:
+    """
+    Wrap a stream so that the text written by a thread can be held back and
+    written out all at once.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            self.stream.write(text)
+        else:
+            buffer.append(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    Stream handler that can hold back the records emitted by a thread and write
+    them out all at once, so that the logs of concurrent threads do not
+    interleave. The buffering happens in the stream as any frames added to the
+    handler would offset the indentation computed by ``IndentFormatter``.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(ThreadBufferedStream(stream or sys.stderr))
+
+    @contextmanager
+    def buffered(self):
+        """
+        Buffer the logs of the current thread for the duration of the context
+        and write them out, in one go, on exit.
+        """
+        local = self.stream.local
+        local.buffer = []
+        try:
+            yield
+        finally:
+            buffer = local.buffer
+            local.buffer = None
+            if buffer:
+                self.acquire()
+                try:
+                    self.stream.write("".join(buffer))
+                    self.flush()
+                finally:
+                    self.release()
+
+
 def setup_logger():
     """
     Configure RootLogger. This method must be called only once from the main
@@ -148,14 +334,79 @@ def setup_logger():
             if isinstance(formatter, IndentFormatter):
                 formatter.delta_indent(delta)
 
+    @contextmanager
+    def indented_class(self, delta=1):
+        """
+        Indent the output of the logger by the given number of steps for the
+        duration of the context.
+        @param delta: the number of steps by which to indent the logs
+        """
+        self.change_indent(delta)
+        try:
+            yield
+        finally:
+            self.change_indent(-delta)
+
+    def get_indent_level_class(self, stacklevel=1):
+        """
+        Get the indentation level of logs emitted by the functions called from
+        the given frame of the calling thread.
+        @param stacklevel: the number of frames to go up from the caller (1
+            being the caller itself)
+        @return: the indentation level
+        """
+        handlers = self.handlers
+        if len(handlers) > 0:
+            formatter = handlers[-1].formatter
+            if isinstance(formatter, IndentFormatter):
+                return formatter.get_level(sys._getframe(stacklevel))
+        return 0
+
+    @contextmanager
+    def worker_class(self, level, buffer=True):
+        """
+        Continue the logs at the given indentation level (see
+        get_indent_level) for the functions called, within the context, by the
+        caller. The logs are buffered and written out together on exit unless
+        buffer is False.
+        @param level: the indentation level to continue from
+        @param buffer: whether to buffer the logs
+        """
+        # 0 is this generator and 1 is the __enter__ method of the context
+        # manager, so 2 is the frame of the with statement
+        frame = sys._getframe(2)
+        formatter = None
+        handler = None
+        if len(self.handlers) > 0:
+            handler = self.handlers[-1]
+            if isinstance(handler.formatter, IndentFormatter):
+                formatter = handler.formatter
+        previous = None
+        if formatter is not None:
+            previous = formatter.bind_thread(level, frame)
+        try:
+            if buffer and isinstance(handler, BufferedStreamHandler):
+                with handler.buffered():
+                    yield
+            else:
+                yield
+        finally:
+            if previous is not None:
+                formatter.baseline, formatter.manual_push = previous
+
     logging.addLevelName(SUCCESS, "SUCCESS")
     setattr(logging.getLoggerClass(), "success", log_success_class)
     setattr(logging, "success", log_success_root)
     setattr(logging.getLoggerClass(), "change_indent", change_indent_class)
+    setattr(logging.getLoggerClass(), "indented", indented_class)
+    setattr(
+        logging.getLoggerClass(), "get_indent_level", get_indent_level_class
+    )
+    setattr(logging.getLoggerClass(), "worker", worker_class)
 
     formatter = IndentFormatter()
 
-    handler = logging.StreamHandler()
+    handler = BufferedStreamHandler()
     handler.setFormatter(formatter)
 
     logger = logging.root
@@ -0,0 +1,212 @@
+# Standard library
+import json
+import logging
+
+# Third-party
+import yaml
+
+# First-party/Local
+from ccos.cache import get_cache_dir, write_atomic
+from ccos.gh_utils import GITHUB_ORGANIZATION, setup_github_gql_client
+from ccos.gql_batch import execute_aliased
+
+CC_METADATA_FILE_NAME = ".cc-metadata.yml"
+FIELD_METADATA_OID = f"""
+    repository(owner: $owner, name: $name) {{
+        object(expression: "HEAD:{CC_METADATA_FILE_NAME}") {{
+            ... on Blob {{
+                oid
+            }}
+        }}
+    }}
+"""
+FIELD_METADATA_TEXT = """
+    repository(owner: $owner, name: $name) {
+        object(oid: $oid) {
+            ... on Blob {
+                text
+            }
+        }
+    }
+"""
+LOG = logging.root
+VARIABLES_METADATA_OID = {"owner": "String!", "name": "String!"}
+VARIABLES_METADATA_TEXT = {
+    "owner": "String!",
+    "name": "String!",
+    "oid": "GitObjectID!",
+}
+# Metadata already retrieved by this process, by repo name
+METADATA = {}
+
+
+def get_metadata_cache_file(oid):
+    return get_cache_dir("cc-metadata").joinpath(f"{oid}.json")
+
+
+def load_cached_metadata(oid):
+    """
+    Load the parsed contents of the .cc-metadata.yml blob with the given OID
+    from the on-disk cache.
+    @param oid: the object ID of the blob
+    @return: whether the blob was found in the cache and its parsed contents
+    """
+    cache_file = get_metadata_cache_file(oid)
+    if not cache_file.exists():
+        return False, None
+    with open(cache_file, "r") as file_obj:
+        return True, json.load(file_obj)
+
+
+def store_cached_metadata(oid, metadata):
+    """
+    Store the parsed contents of the .cc-metadata.yml blob with the given OID
+    in the on-disk cache. As blobs are immutable, entries never expire.
+    @param oid: the object ID of the blob
+    @param metadata: the parsed contents of the blob
+    """
+    try:
+        data = json.dumps(metadata).encode("utf-8")
+    except TypeError:
+        # YAML values without a JSON equivalent (dates, for example) are not
+        # cached so that they are always returned with the same types
+        return
+    write_atomic(get_metadata_cache_file(oid), data)
+
+
+def get_metadata_oids(github_gql_client, repo_names):
+    """
+    Get the object IDs of the .cc-metadata.yml files of the given repos with
+    batched GraphQL queries.
+    @param github_gql_client: the GitHub GraphQL API client
+    @param repo_names: the names of the repos
+    @return: the dict mapping repo names to the object IDs of their metadata
+        files (None for repos without one)
+    """
+    items = [
+        (repo_name, {"owner": GITHUB_ORGANIZATION, "name": repo_name})
+        for repo_name in repo_names
+    ]
+    results, failures = execute_aliased(
+        github_gql_client,
+        "query",
+        FIELD_METADATA_OID,
+        VARIABLES_METADATA_OID,
+        items,
+    )
+    for repo_name, messages in failures.items():
+        LOG.warning(
+            f"{repo_name}: unable to fetch {CC_METADATA_FILE_NAME}:"
+            f" {'; '.join(messages)}"
+        )
+    oids = {}
+    for repo_name, repository in results.items():
+        blob = (repository or {}).get("object") or {}
+        oids[repo_name] = blob.get("oid")
+    return oids
+
+
+def get_metadata_texts(github_gql_client, repo_oids):
+    """
+    Get the contents of the given .cc-metadata.yml blobs with batched GraphQL
+    queries.
+    @param github_gql_client: the GitHub GraphQL API client
+    @param repo_oids: the dict mapping repo names to the object IDs of the
+        blobs to download
+    @return: the dict mapping repo names to the text of their metadata files
+    """
+    items = [
+        (
+            repo_name,
+            {"owner": GITHUB_ORGANIZATION, "name": repo_name, "oid": oid},
+        )
+        for repo_name, oid in repo_oids.items()
+    ]
+    results, failures = execute_aliased(
+        github_gql_client,
+        "query",
+        FIELD_METADATA_TEXT,
+        VARIABLES_METADATA_TEXT,
+        items,
+    )
+    for repo_name, messages in failures.items():
+        LOG.warning(
+            f"{repo_name}: unable to fetch {CC_METADATA_FILE_NAME}:"
+            f" {'; '.join(messages)}"
+        )
+    texts = {}
+    for repo_name, repository in results.items():
+        blob = (repository or {}).get("object") or {}
+        if blob.get("text") is not None:
+            texts[repo_name] = blob["text"]
+    return texts
+
+
+def get_cc_metadata(repo_names, github_gql_client=None, oids=None):
+    """
+    Get the parsed contents of the .cc-metadata.yml files of the given repos.
+    The object IDs of all files are read with one query per 50 repos (except
+    for those that are given) and only the files whose object ID is not in
+    the on-disk cache are downloaded and parsed. The results are also kept in
+    memory for the rest of the process.
+
+    The returned dicts are shared and must not be modified (copy them first).
+
+    @param repo_names: the names of the repos
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @param oids: the dict mapping repo names to the object IDs of their
+        metadata files, None for repos without one, as recorded by the
+        organization snapshot (optional, may leave out some of the repos)
+    @return: the dict mapping repo names to their metadata (None for repos
+        without a metadata file or for which it could not be retrieved)
+    """
+    missing = [name for name in repo_names if name not in METADATA]
+    if missing:
+        if github_gql_client is None:
+            github_gql_client = setup_github_gql_client()
+        LOG.info(
+            f"Fetching {CC_METADATA_FILE_NAME} of {len(missing)} repos..."
+        )
+        known_oids = oids or {}
+        oids = {
+            name: known_oids[name] for name in missing if name in known_oids
+        }
+        unknown = [name for name in missing if name not in known_oids]
+        if unknown:
+            oids.update(get_metadata_oids(github_gql_client, unknown))
+        downloads = {}
+        for repo_name, oid in oids.items():
+            if oid is None:
+                METADATA[repo_name] = None
+                continue
+            found, metadata = load_cached_metadata(oid)
+            if found:
+                METADATA[repo_name] = metadata
+            else:
+                downloads[repo_name] = oid
+        texts = get_metadata_texts(github_gql_client, downloads)
+        for repo_name, text in texts.items():
+            metadata = yaml.safe_load(text)
+            store_cached_metadata(downloads[repo_name], metadata)
+            METADATA[repo_name] = metadata
+        unchanged = len(oids) - len(downloads)
+        LOG.success(
+            f"done. Downloaded {len(texts)} files, {unchanged} were unchanged"
+            " or missing."
+        )
+    return {name: METADATA.get(name) for name in repo_names}
+
+
+def is_engineering_project(metadata):
+    """
+    Determine whether the repo with the given metadata is an engineering
+    project.
+    @param metadata: the parsed contents of the metadata file (or None)
+    @return: whether the repo is an engineering project
+    """
+    if not isinstance(metadata, dict):
+        return False
+    return metadata.get("engineering_project", False)
+
+
+__all__ = ["get_cc_metadata", "is_engineering_project"]
@@ -0,0 +1,353 @@
+# Standard library
+import functools
+import logging
+from pathlib import Path
+
+# Third-party
+import yaml
+from github import GithubException
+
+# First-party/Local
+from ccos.gh_utils import GITHUB_ORGANIZATION, setup_github_gql_client
+from ccos.gql_batch import execute_aliased
+from ccos.metadata import get_cc_metadata, is_engineering_project
+from ccos.parallel import RepoExecutor
+from ccos.snapshot import get_cc_metadata_oids
+
+CONFIG_PATH = (
+    Path(__file__).resolve().parent.joinpath("branch_protections.yml")
+)
+LOG = logging.root
+FIELD_REPOSITORY_PROTECTION = """
+    repository(owner: $owner, name: $name) {
+        defaultBranchRef {
+            name
+        }
+        branchProtectionRules(first: 100) {
+            nodes {
+                allowsDeletions
+                allowsForcePushes
+                blocksCreations
+                bypassPullRequestAllowances(first: 100) {
+                    nodes {
+                        actor {
+                            __typename
+                            ... on App {
+                                slug
+                            }
+                            ... on Team {
+                                slug
+                            }
+                            ... on User {
+                                login
+                            }
+                        }
+                    }
+                }
+                dismissesStaleReviews
+                isAdminEnforced
+                lockAllowsFetchAndMerge
+                lockBranch
+                pattern
+                pushAllowances(first: 100) {
+                    nodes {
+                        actor {
+                            __typename
+                            ... on App {
+                                slug
+                            }
+                            ... on Team {
+                                slug
+                            }
+                            ... on User {
+                                login
+                            }
+                        }
+                    }
+                }
+                requireLastPushApproval
+                requiredApprovingReviewCount
+                requiredStatusCheckContexts
+                requiresApprovingReviews
+                requiresCodeOwnerReviews
+                requiresConversationResolution
+                requiresLinearHistory
+                requiresStatusChecks
+                requiresStrictStatusChecks
+                restrictsPushes
+                restrictsReviewDismissals
+            }
+        }
+    }
+"""
+VARIABLES_REPOSITORY_PROTECTION = {"owner": "String!", "name": "String!"}
+
+
+@functools.cache
+def load_branch_protection_config():
+    """
+    Load the branch protection configuration. The file is only read once per
+    process.
+    @return: the configuration dict
+    """
+    with open(CONFIG_PATH, "r") as file:
+        config = yaml.safe_load(file)
+    return config
+
+
+def get_edit_arguments(repo_name):
+    """
+    Get the arguments to pass to edit_protection for the given repo.
+    @param repo_name: the name of the repo
+    @return: the dict of keyword arguments
+    """
+    config = load_branch_protection_config()
+    required_status_check_map = config["REQUIRED_STATUS_CHECK_MAP"]
+    exempt_users = config.get("EXEMPT_USERS", {}).get(repo_name, [])
+    # The following empty *_bypass_pull_request_allowance arguments ensure
+    # the required bypass_pull_request_allowances API parameter is
+    # populated:
+    # https://docs.github.com/rest/branches/branch-protection#update-branch-protection
+    arguments = {
+        "required_approving_review_count": 1,
+        "user_push_restrictions": [],
+        "users_bypass_pull_request_allowances": exempt_users,
+        "teams_bypass_pull_request_allowances": [],
+        "apps_bypass_pull_request_allowances": [],
+    }
+    if repo_name in required_status_check_map:
+        arguments["contexts"] = required_status_check_map[repo_name]
+    return arguments
+
+
+def get_desired_settings(arguments):
+    """
+    Get the effective protection settings that result from calling
+    edit_protection with the given arguments. edit_protection replaces the
+    whole protection, so every setting that is not passed is disabled.
+    @param arguments: the keyword arguments for edit_protection (see
+        get_edit_arguments)
+    @return: the dict of settings (see get_current_settings)
+    """
+    contexts = arguments.get("contexts")
+    bypass_actors = [
+        ("User", login)
+        for login in arguments["users_bypass_pull_request_allowances"]
+    ]
+    return {
+        "allows_deletions": False,
+        "allows_force_pushes": False,
+        "blocks_creations": False,
+        "bypass_pull_request_allowances": sorted(bypass_actors),
+        "dismisses_stale_reviews": False,
+        "is_admin_enforced": False,
+        "lock_allows_fetch_and_merge": False,
+        "lock_branch": False,
+        "push_allowances": [],
+        "require_last_push_approval": False,
+        "required_approving_review_count": arguments[
+            "required_approving_review_count"
+        ],
+        "required_status_check_contexts": sorted(contexts or []),
+        "requires_approving_reviews": True,
+        "requires_code_owner_reviews": False,
+        "requires_conversation_resolution": False,
+        "requires_linear_history": False,
+        "requires_status_checks": contexts is not None,
+        "requires_strict_status_checks": False,
+        "restricts_pushes": True,
+        "restricts_review_dismissals": False,
+    }
+
+
+def get_actors(allowances):
+    """
+    Get the sorted list of actors of the given allowances.
+    @param allowances: the connection of the allowances from the API
+    @return: the list of (type, login or slug) pairs
+    """
+    actors = []
+    for node in allowances["nodes"]:
+        actor = node["actor"] or {}
+        name = actor.get("login", actor.get("slug"))
+        actors.append((actor.get("__typename"), name))
+    return sorted(actors)
+
+
+def get_current_settings(rule):
+    """
+    Get the effective protection settings of the given branch protection rule.
+    @param rule: the branch protection rule from the API
+    @return: the dict of settings
+    """
+    return {
+        "allows_deletions": rule["allowsDeletions"],
+        "allows_force_pushes": rule["allowsForcePushes"],
+        "blocks_creations": rule["blocksCreations"],
+        "bypass_pull_request_allowances": get_actors(
+            rule["bypassPullRequestAllowances"]
+        ),
+        "dismisses_stale_reviews": rule["dismissesStaleReviews"],
+        "is_admin_enforced": rule["isAdminEnforced"],
+        "lock_allows_fetch_and_merge": rule["lockAllowsFetchAndMerge"],
+        "lock_branch": rule["lockBranch"],
+        "push_allowances": get_actors(rule["pushAllowances"]),
+        "require_last_push_approval": rule["requireLastPushApproval"],
+        "required_approving_review_count": rule[
+            "requiredApprovingReviewCount"
+        ],
+        "required_status_check_contexts": sorted(
+            rule["requiredStatusCheckContexts"] or []
+        ),
+        "requires_approving_reviews": rule["requiresApprovingReviews"],
+        "requires_code_owner_reviews": rule["requiresCodeOwnerReviews"],
+        "requires_conversation_resolution": rule[
+            "requiresConversationResolution"
+        ],
+        "requires_linear_history": rule["requiresLinearHistory"],
+        "requires_status_checks": rule["requiresStatusChecks"],
+        "requires_strict_status_checks": rule["requiresStrictStatusChecks"],
+        "restricts_pushes": rule["restrictsPushes"],
+        "restricts_review_dismissals": rule["restrictsReviewDismissals"],
+    }
+
+
+def get_protection_states(github_gql_client, repo_names):
+    """
+    Get the default branch and its current protection settings for all of the
+    given repos with batched GraphQL queries.
+    @param github_gql_client: the GitHub GraphQL API client
+    @param repo_names: the names of the repos
+    @return: the dict mapping repo names to (default branch name, settings)
+        pairs. The branch name is None if the repo has no default branch and
+        the settings are None if the branch is not protected
+    """
+    LOG.info("Fetching current branch protections...")
+    items = [
+        (repo_name, {"owner": GITHUB_ORGANIZATION, "name": repo_name})
+        for repo_name in repo_names
+    ]
+    results, failures = execute_aliased(
+        github_gql_client,
+        "query",
+        FIELD_REPOSITORY_PROTECTION,
+        VARIABLES_REPOSITORY_PROTECTION,
+        items,
+    )
+    for repo_name, messages in failures.items():
+        LOG.warning(
+            f"{repo_name}: unable to fetch branch protections:"
+            f" {'; '.join(messages)}"
+        )
+    states = {}
+    for repo_name, repository in results.items():
+        if repository is None or repository["defaultBranchRef"] is None:
+            states[repo_name] = (None, None)
+            continue
+        default_branch = repository["defaultBranchRef"]["name"]
+        settings = None
+        for rule in repository["branchProtectionRules"]["nodes"]:
+            if rule["pattern"] == default_branch:
+                settings = get_current_settings(rule)
+                break
+        states[repo_name] = (default_branch, settings)
+    LOG.success("done.")
+    return states
+
+
+def update_branch_protection(repo, default_branch_name, arguments):
+    """
+    Update the protection of the default branch of the given repo.
+    @param repo: the repo whose default branch to protect
+    @param default_branch_name: the name of the default branch
+    @param arguments: the keyword arguments for edit_protection
+    @return: whether the protection was updated
+    """
+    try:
+        default_branch = repo.get_branch(default_branch_name)
+    except GithubException as e:
+        if e.data["message"] == "Branch not found":
+            LOG.warning(f"{repo.name}: skipping: default branch not found")
+            return False
+        else:
+            raise
+    LOG.info(f"{repo.name}: updating branch protections")
+    default_branch.edit_protection(**arguments)
+    return True
+
+
+def update_branch_protections(repos, github_gql_client=None, executor=None):
+    """
+    Protect the default branch of all repos which are not exempt and are
+    engineering projects. The current protections of all repos are read up
+    front and REST API calls are only made for the repos whose effective
+    settings differ from the configured ones.
+
+    This is the main entrypoint of the module.
+
+    @param repos: the repos whose default branches to protect
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @param executor: the RepoExecutor with which to apply the changes
+        (optional)
+    """
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    if executor is None:
+        executor = RepoExecutor()
+    exempt_repositories = load_branch_protection_config()[
+        "EXEMPT_REPOSITORIES"
+    ]
+    candidates = []
+    for repo in repos:
+        if repo.name in exempt_repositories:
+            LOG.info(f"{repo.name}: skipping: exempt")
+        else:
+            candidates.append(repo)
+    states = get_protection_states(
+        github_gql_client, [repo.name for repo in candidates]
+    )
+
+    arguments = []
+    up_to_date = 0
+    for repo in candidates:
+        if repo.name not in states:
+            continue
+        default_branch, current_settings = states[repo.name]
+        if default_branch is None:
+            LOG.warning(f"{repo.name}: skipping: default branch not found")
+            continue
+        edit_arguments = get_edit_arguments(repo.name)
+        if current_settings == get_desired_settings(edit_arguments):
+            up_to_date += 1
+            continue
+        arguments.append((repo, default_branch, edit_arguments))
+
+    # Only the repos that require changes need to be checked for being
+    # engineering projects. The object IDs of their metadata files are known
+    # from the snapshot, so only the files missing from the cache are fetched
+    cc_metadata = get_cc_metadata(
+        [repo.name for repo, _, _ in arguments],
+        github_gql_client,
+        oids=get_cc_metadata_oids(),
+    )
+    engineering_arguments = []
+    for repo, default_branch, edit_arguments in arguments:
+        if is_engineering_project(cc_metadata[repo.name]):
+            engineering_arguments.append(
+                (repo, default_branch, edit_arguments)
+            )
+        else:
+            LOG.info(f"{repo.name}: skipping: exempt")
+    arguments = engineering_arguments
+
+    results = executor.map(
+        "Updating branch protections", update_branch_protection, arguments
+    )
+    updated = sum(1 for result in results.values() if result)
+    LOG.success(
+        f"done. Updated {updated} repos, skipped writes for {up_to_date}"
+        " repos that were already up to date."
+    )
+
+
+__all__ = ["update_branch_protections"]
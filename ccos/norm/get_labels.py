@@ -1,14 +1,78 @@
 # Standard library
+import functools
 import logging
+from collections import namedtuple
 from pathlib import Path
+from types import MappingProxyType
 
 # Third-party
 import yaml
 
 # First-party/Local
-from ccos.norm.models import Group, Label
+from ccos.norm.models import Group, Label, RequiredLabelIndex
 
 LOG = logging.root
+# The libyaml based loader is several times faster than the pure Python one
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# The resolved attributes of a label, as passed to the GitHub API. The fields
+# mirror those of the labels returned by the API so that rows can be compared
+# with them directly.
+LabelRow = namedtuple("LabelRow", ["name", "color", "description"])
+LabelCatalogue = namedtuple(
+    "LabelCatalogue",
+    [
+        "groups",
+        "standard_labels",
+        "repo_specific_labels",
+        "table",
+        "required_label_index",
+    ],
+)
+
+
+def get_groups(labels_dict):
+    """
+    Build the label groups, and their labels, defined in the labels datafile.
+    @param labels_dict: the contents of the labels datafile
+    @return: the tuple of label groups
+    """
+    return tuple(Group(**group_info) for group_info in labels_dict["groups"])
+
+
+@functools.cache
+def get_label_catalogue():
+    """
+    Get the catalogue of all labels. The datafiles are only loaded, and the
+    labels only resolved, once per process; all consumers share the returned
+    instance, which must not be modified.
+    @return: the LabelCatalogue instance
+    """
+    labels_dict = load_yaml_from_file("labels")
+    label_groups = get_groups(labels_dict)
+    standard_labels = [
+        label for group in label_groups for label in group.labels
+    ]
+    for label_info in labels_dict["standalone"]:
+        standard_labels.append(Label(**label_info))
+    repo_specific_labels = get_repo_specific_labels()
+
+    table = {}
+    all_labels = standard_labels + [
+        label for labels in repo_specific_labels.values() for label in labels
+    ]
+    for label in all_labels:
+        table[label.qualified_name] = LabelRow(**label.api_arguments)
+
+    required_label_groups = [
+        group for group in label_groups if group.is_required
+    ]
+    return LabelCatalogue(
+        groups=label_groups,
+        standard_labels=tuple(standard_labels),
+        repo_specific_labels=MappingProxyType(repo_specific_labels),
+        table=MappingProxyType(table),
+        required_label_index=RequiredLabelIndex(required_label_groups),
+    )
 
 
 def get_required_label_groups():
@@ -18,15 +82,7 @@ def get_required_label_groups():
     @return: the filtered list of label groups that that are required by
         definition
     """
-    labels_dict = load_yaml_from_file("labels")
-    label_groups = []
-    for group_info in labels_dict["groups"]:
-        group = Group(**group_info)
-        label_names = group_info.pop("labels", [])
-        label_groups.append(group)
-        for label_info in label_names:
-            Label(**label_info, group=group)
-
+    label_groups = get_label_catalogue().groups
     LOG.info(f"Filtering {len(label_groups)} label_groups...")
     required_label_groups = [
         group for group in label_groups if group.is_required
@@ -35,23 +91,20 @@ def get_required_label_groups():
     return required_label_groups
 
 
+def get_required_label_index():
+    """
+    Get the compiled index of the required label groups.
+    @return: the shared RequiredLabelIndex instance
+    """
+    return get_label_catalogue().required_label_index
+
+
 def get_standard_labels():
     """
     Get the list of standard labels that apply to every repository.
     @return: the list of standard labels
     """
-    labels_dict = load_yaml_from_file("labels")
-    standard_labels = []
-    for group_info in labels_dict["groups"]:
-        label_names = group_info.pop("labels", [])
-        group = Group(**group_info)
-        for label_info in label_names:
-            label = Label(**label_info, group=group)
-            standard_labels.append(label)
-    for label_info in labels_dict["standalone"]:
-        label = Label(**label_info)
-        standard_labels.append(label)
-    return standard_labels
+    return list(get_label_catalogue().standard_labels)
 
 
 def get_repo_specific_labels():
@@ -64,10 +117,10 @@ def get_repo_specific_labels():
     labels_dict = load_yaml_from_file("skills")
     repo_specific_labels = {}
     for repo_name, skill_names in labels_dict.items():
-        skill_labels = [
+        skill_labels = tuple(
             get_skill_label_from_name(skill_group, skill_name)
             for skill_name in skill_names
-        ]
+        )
         repo_specific_labels[repo_name] = skill_labels
     return repo_specific_labels
 
@@ -99,7 +152,7 @@ def load_yaml_from_file(file_name):
     """
     file_path = get_datafile_path(file_name)
     with open(file_path, "r") as file:
-        data = yaml.safe_load(file)
+        data = yaml.load(file, Loader=SafeLoader)
     return data
 
 
@@ -120,9 +173,18 @@ def get_labels():
     Get the list of standard and repository-specific labels.
     @return: the list of standard and repository-specific labels
     """
-    standard_labels = get_standard_labels()
-    repo_specific_labels = get_repo_specific_labels()
+    catalogue = get_label_catalogue()
+    standard_labels = list(catalogue.standard_labels)
+    repo_specific_labels = {
+        repo_name: list(labels)
+        for repo_name, labels in catalogue.repo_specific_labels.items()
+    }
     return standard_labels, repo_specific_labels
 
 
-__all__ = ["get_labels", "get_required_label_groups"]
+__all__ = [
+    "get_label_catalogue",
+    "get_labels",
+    "get_required_label_groups",
+    "get_required_label_index",
+]
@@ -1,3 +1,6 @@
+# Standard library
+from types import MappingProxyType
+
 COLORS = {
     "UNFAVOURABLE": "b60205",
     "NEGATIVE": "ff9f1c",
@@ -14,24 +17,61 @@ COLORS = {
 }
 
 
-class Group:
+class FrozenModel:
+    """
+    This model is the base of the immutable models. Attributes are assigned
+    once, in the constructor, with ``_set`` and cannot be changed afterwards.
+    """
+
+    __slots__ = ()
+
+    def _set(self, **kwargs):
+        for name, value in kwargs.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} instances are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} instances are immutable")
+
+
+class Group(FrozenModel):
     """
     This model represents a group of labels. A group has some fixed parameters
     - name, which may be prefixed to all child label names
     - color, which acts as a fallback for child labels that do not specify one
     - is_prefixed, which determines if group name is prefixed on child labels
     - is_required, which determines if >=1 sub-label must be applied on issues
+
+    The child labels given as definitions are built along with the group and
+    stored as the ``labels`` tuple. Labels created separately with the group
+    as their parent are not added to it.
     """
 
+    __slots__ = ("name", "color", "is_prefixed", "is_required", "labels")
+
     def __init__(
-        self, color=None, is_prefixed=True, is_required=False, **kwargs
+        self,
+        color=None,
+        is_prefixed=True,
+        is_required=False,
+        labels=(),
+        **kwargs,
     ):
-        self.name = kwargs["name"]
-        self.color = color
-        self.is_prefixed = is_prefixed
-        self.is_required = is_required
-
-        self.labels = []  # This may or may not be populated, do not rely
+        self._set(
+            name=kwargs["name"],
+            color=color,
+            is_prefixed=is_prefixed,
+            is_required=is_required,
+        )
+        # The labels resolve their derived fields from the group, so they are
+        # built once its other attributes are set
+        self._set(
+            labels=tuple(
+                Label(**label_info, group=self) for label_info in labels
+            )
+        )
 
     def __str__(self):
         return self.name
@@ -40,7 +80,7 @@ class Group:
         return f"<Group '{self}'>"
 
 
-class Label:
+class Label(FrozenModel):
     """
     This model represents a single label. A label is defined by four parameters
     - name, which appears on the label
@@ -49,24 +89,48 @@ class Label:
     - color, which is used as a background on the label element
 
     A ``Label`` instance is associated to a ``Group`` instance by a many to one
-    relationship.
+    relationship. The derived attributes ``color``, ``qualified_name`` and
+    ``api_arguments`` are resolved once, when the label is created. Labels are
+    hashed by their qualified name.
     """
 
-    def __init__(self, group=None, color=None, has_emoji_name=True, **kwargs):
-        self.name = kwargs["name"]
-        self.description = kwargs["description"]
-        self.emoji = kwargs["emoji"]
-        self.own_color = color
-        self.has_emoji_name = has_emoji_name
+    __slots__ = (
+        "name",
+        "description",
+        "emoji",
+        "own_color",
+        "has_emoji_name",
+        "group",
+        "color",
+        "qualified_name",
+        "api_arguments",
+    )
 
-        self.group = group
-        if group and self not in group.labels:
-            group.labels.append(self)
+    def __init__(self, group=None, color=None, has_emoji_name=True, **kwargs):
+        self._set(
+            name=kwargs["name"],
+            description=kwargs["description"],
+            emoji=kwargs["emoji"],
+            own_color=color,
+            has_emoji_name=has_emoji_name,
+            group=group,
+        )
+        self._set(
+            color=self.get_color(), qualified_name=self.get_qualified_name()
+        )
+        self._set(
+            api_arguments=MappingProxyType(
+                {
+                    "name": self.qualified_name,
+                    "color": self.color,
+                    "description": self.description,
+                }
+            )
+        )
 
-    @property
-    def color(self):
+    def get_color(self):
         """
-        Return the color to use on the emoji label, given as a 6-digit
+        Get the color to use on the emoji label, given as a 6-digit
         hexadecimal code without the prefix '#'. Labels can have their color
         specified as a constant and if missing inherit color from the parent
         group. If not resolved, the color defaults to pure black.
@@ -82,10 +146,9 @@ class Label:
             color = COLORS[color]
         return color
 
-    @property
-    def qualified_name(self):
+    def get_qualified_name(self):
         """
-        Return the fully qualified name of the label. Most label groups prefix
+        Get the fully qualified name of the label. Most label groups prefix
         the group name to the name of the label, separated by a dunder, as
         indicated by the ``is_prefixed`` attribute on the associated ``Group``
         instance.
@@ -110,34 +173,29 @@ class Label:
 
         return f"{self.emoji} {self.description}"
 
-    @property
-    def api_arguments(self):
-        """
-        Get the dictionary of arguments to pass to the API for creating the
-        label. The API only accepts ``name``, ``color`` and ``description``.
-        @return: the API arguments as a dictionary
-        """
-
-        return {
-            "name": self.qualified_name,
-            "color": self.color,
-            "description": self.description,
-        }
-
     def __eq__(self, remote):
         """
-        Compare this instance with the corresponding PyGithub instance to
-        determine whether the two are equal.
+        Compare this instance with the corresponding PyGithub instance (or
+        another Label instance) to determine whether the two are equal. The
+        comparison stops at the first attribute that differs. Objects that
+        are not labels are left to Python to compare.
         @param remote: the PyGithub label instance to compare itself against
-        @return: whether the instance is equal to its remote counterpart
+        @return: whether the instance is equal to its remote counterpart (or
+            NotImplemented if it cannot be compared)
         """
 
-        return all(
-            [
-                self.qualified_name == remote.name,
-                self.color == remote.color,
-                self.description == remote.description,
-            ]
+        if isinstance(remote, Label):
+            remote_name = remote.qualified_name
+        elif all(
+            hasattr(remote, name) for name in ["name", "color", "description"]
+        ):
+            remote_name = remote.name
+        else:
+            return NotImplemented
+        return (
+            self.qualified_name == remote_name
+            and self.color == remote.color
+            and self.description == remote.description
         )
 
     def __ne__(self, remote):
@@ -145,19 +203,91 @@ class Label:
         Compare this instance with the corresponding PyGithub instance to
         determine whether the two are unequal and would need to be reconciled.
         @param remote: the PyGithub label instance to compare itself against
-        @return: whether the instance is unequal to its remote counterpart
+        @return: whether the instance is unequal to its remote counterpart (or
+            NotImplemented if it cannot be compared)
         """
 
-        return any(
-            [
-                self.qualified_name != remote.name,
-                self.color != remote.color,
-                self.description != remote.description,
-            ]
-        )
+        equal = self.__eq__(remote)
+        if equal is NotImplemented:
+            return NotImplemented
+        return not equal
+
+    def __hash__(self):
+        return hash(self.qualified_name)
 
     def __str__(self):
         return self.qualified_name
 
     def __repr__(self):
         return f"<Label '{self}'>"
+
+
+class RequiredLabelIndex:
+    """
+    This model is a compiled lookup of the required label groups. Every
+    qualified label name is mapped to a bitmask of the required groups that it
+    satisfies, so checking the labels of an issue only takes a few integer
+    operations:
+    - group_names, the names of the required groups, in bit order
+    - masks, the dict mapping qualified label names to their bitmasks
+    - full_mask, the bitmask of a valid issue (every group satisfied)
+    """
+
+    def __init__(self, required_label_groups):
+        self.group_names = tuple(group.name for group in required_label_groups)
+        self.masks = {}
+        for bit, group in enumerate(required_label_groups):
+            for label in group.labels:
+                name = label.qualified_name
+                self.masks[name] = self.masks.get(name, 0) | (1 << bit)
+        self.full_mask = (1 << len(self.group_names)) - 1
+        self.missing_groups = {}
+
+    def get_mask(self, label_names):
+        """
+        Get the bitmask of the required groups satisfied by the given labels.
+        @param label_names: the names of the labels applied to an issue
+        @return: the bitmask of the satisfied groups
+        """
+        mask = 0
+        masks = self.masks
+        for name in label_names:
+            mask |= masks.get(name, 0)
+        return mask
+
+    def get_missing_groups(self, label_names):
+        """
+        Get the names of the required groups not satisfied by the given labels.
+        @param label_names: the names of the labels applied to an issue
+        @return: the tuple of the names of the missing groups, in group order
+        """
+        missing = self.full_mask & ~self.get_mask(label_names)
+        if missing not in self.missing_groups:
+            self.missing_groups[missing] = tuple(
+                name
+                for bit, name in enumerate(self.group_names)
+                if missing & (1 << bit)
+            )
+        return self.missing_groups[missing]
+
+    def is_valid(self, label_names):
+        """
+        Check whether the given labels satisfy all of the required groups.
+        @param label_names: the names of the labels applied to an issue
+        @return: whether every required group is satisfied
+        """
+        return self.get_mask(label_names) == self.full_mask
+
+    def validate_many(self, label_sets):
+        """
+        Check the labels of many issues at once, for example all the open
+        issues of a repo or an exported dump of issues.
+        @param label_sets: the iterable of collections of label names, one per
+            issue
+        @return: the list of whether each issue satisfies every required
+            group, in order
+        """
+        return [self.is_valid(label_names) for label_names in label_sets]
+
+    def __repr__(self):
+        return f"<RequiredLabelIndex {', '.join(self.group_names)}>"
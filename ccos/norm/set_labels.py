@@ -1,79 +1,274 @@
 # Standard library
 import logging
+from collections import namedtuple
+from urllib.parse import quote
+
+# Third-party
+from github.Label import Label
+
+# First-party/Local
+from ccos.gh_utils import (
+    GITHUB_ORGANIZATION,
+    gql_query,
+    setup_github_gql_client,
+)
+from ccos.norm.get_labels import get_label_catalogue
+from ccos.parallel import RepoExecutor
 
 LOG = logging.root
+# Mirrors the attributes of the PyGithub Label compared by models.Label
+RemoteLabel = namedtuple("RemoteLabel", ["name", "color", "description"])
 
 
-def map_repo_to_labels(repo, final_labels, non_destructive=True):
+def get_remote_labels(github_gql_client, repo_names):
     """
-    Map the given list of labels to GitHub. Any labels that do not already
-    exist on the repository will be created and if chosen to, any additional
-    lables on the repository will be removed.
-    @param repo: the repo on which the labels are being synced
-    @param final_labels: the list of labels that should be present on the repo
-    @param non_destructive: whether to trim extra labels or preserve them
+    Get the labels of all given repositories with one paginated GraphQL query
+    over all (non-archived) repositories of the organization. The few
+    repositories with more than 100 labels have the rest of their labels
+    fetched separately.
+
+    @param github_gql_client: the GitHub GraphQL API client
+    @param repo_names: the names of the repositories whose labels to get
+    @return: the dict mapping repo names to dicts mapping casefolded label
+        names to RemoteLabel instances
     """
     LOG.info("Fetching initial labels...")
-    initial_labels = {
-        label.name.casefold(): label for label in repo.get_labels()
-    }
-    LOG.success(f"done. Found {len(initial_labels)} labels.")
+    query = gql_query(
+        """
+        query($cursor: String, $organization: String!) {
+            organization(login: $organization) {
+                repositories(
+                    after: $cursor
+                    first: 100
+                    isArchived: false
+                ) {
+                    nodes {
+                        name
+                        labels(first: 100) {
+                            nodes {
+                                color
+                                description
+                                name
+                            }
+                            pageInfo {
+                                endCursor
+                                hasNextPage
+                            }
+                        }
+                    }
+                    pageInfo {
+                        endCursor
+                        hasNextPage
+                    }
+                }
+            }
+        }
+        """
+    )
+    repo_names = set(repo_names)
+    label_nodes = {}
+    label_cursors = {}
+    cursor = None
+    next_page = True
+    while next_page is True:
+        params = {"cursor": cursor, "organization": GITHUB_ORGANIZATION}
+        result = github_gql_client.execute(query, variable_values=params)
+        repositories = result["organization"]["repositories"]
+        for node in repositories["nodes"]:
+            if node["name"] not in repo_names:
+                continue
+            label_nodes[node["name"]] = node["labels"]["nodes"]
+            if node["labels"]["pageInfo"]["hasNextPage"]:
+                label_cursors[node["name"]] = node["labels"]["pageInfo"][
+                    "endCursor"
+                ]
+        cursor = repositories["pageInfo"]["endCursor"]
+        next_page = repositories["pageInfo"]["hasNextPage"]
 
-    LOG.info("Parsing final labels...")
-    final_labels = {
-        label.qualified_name.casefold(): label for label in final_labels
-    }
-    LOG.success(f"done. Found {len(final_labels)} labels.")
+    for repo_name, cursor in label_cursors.items():
+        label_nodes[repo_name] += get_more_remote_labels(
+            github_gql_client, repo_name, cursor
+        )
 
+    remote_labels = {}
+    for repo_name, nodes in label_nodes.items():
+        remote_labels[repo_name] = {
+            node["name"].casefold(): RemoteLabel(
+                node["name"], node["color"], node["description"]
+            )
+            for node in nodes
+        }
+    LOG.success(f"done. Found labels for {len(remote_labels)} repos.")
+    return remote_labels
+
+
+def get_more_remote_labels(github_gql_client, repo_name, cursor):
+    """
+    Get the remaining labels of a repository, starting after the given cursor.
+
+    @param github_gql_client: the GitHub GraphQL API client
+    @param repo_name: the name of the repository
+    @param cursor: the cursor after which to continue
+    @return: the list of label nodes
+    """
+    query = gql_query(
+        """
+        query($cursor: String, $name: String!, $owner: String!) {
+            repository(name: $name, owner: $owner) {
+                labels(after: $cursor, first: 100) {
+                    nodes {
+                        color
+                        description
+                        name
+                    }
+                    pageInfo {
+                        endCursor
+                        hasNextPage
+                    }
+                }
+            }
+        }
+        """
+    )
+    nodes = []
+    next_page = True
+    while next_page is True:
+        params = {
+            "cursor": cursor,
+            "name": repo_name,
+            "owner": GITHUB_ORGANIZATION,
+        }
+        result = github_gql_client.execute(query, variable_values=params)
+        labels = result["repository"]["labels"]
+        nodes += labels["nodes"]
+        cursor = labels["pageInfo"]["endCursor"]
+        next_page = labels["pageInfo"]["hasNextPage"]
+    return nodes
+
+
+def plan_repo_labels(initial_labels, final_labels, non_destructive=True):
+    """
+    Compute the changes required to bring a repository's labels in line with
+    the given list of labels.
+
+    @param initial_labels: the dict mapping casefolded label names to the
+        labels currently on the repo
+    @param final_labels: the list of LabelRow instances of the labels that
+        should be present on the repo
+    @param non_destructive: whether to trim extra labels or preserve them
+    @return: the plan, a dict with the lists "create" (label rows), "update"
+        (pairs of current label names and label rows) and "delete" (current
+        label names). All lists are empty if no changes are required
+    """
+    final_labels = {label.name.casefold(): label for label in final_labels}
+    plan = {"create": [], "update": [], "delete": []}
     if not non_destructive:
-        LOG.info("Syncing initial labels...")
-        LOG.change_indent(+1)
         for initial_label_name, initial_label in initial_labels.items():
-            LOG.info(f"Syncing '{initial_label_name}'...")
-            LOG.change_indent(+1)
             if initial_label_name not in final_labels:
-                LOG.info("Does not exist, deleting...")
-                initial_label.delete()
-                LOG.success("done.")
-            LOG.change_indent(-1)
-            LOG.success("done.")
-        LOG.change_indent(-1)
-        LOG.success("done.")
-
-    LOG.info("Syncing final labels...")
-    LOG.change_indent(+1)
+                plan["delete"].append(initial_label.name)
     for final_label_name, final_label in final_labels.items():
-        LOG.info(f"Syncing '{final_label_name}'...")
-        LOG.change_indent(+1)
         if final_label_name not in initial_labels:
-            LOG.info("Did not exist, creating...")
-            repo.create_label(**final_label.api_arguments)
-            LOG.success("done.")
+            plan["create"].append(final_label)
         elif final_label != initial_labels[final_label_name]:
-            LOG.info("Differences found, updating...")
             initial_label = initial_labels[final_label_name]
-            initial_label.edit(**final_label.api_arguments)
-            LOG.success("done.")
-        else:
-            LOG.info("Match found, moving on.")
-        LOG.change_indent(-1)
+            plan["update"].append((initial_label.name, final_label))
+    return plan
+
+
+def get_label(repo, name):
+    """
+    Get a lazy PyGithub Label object for the given label of the given repo,
+    without making a request, so that it can be updated or deleted directly.
+
+    @param repo: the repo to which the label belongs
+    @param name: the name of the label
+    @return: the Label object
+    """
+    return Label(
+        repo.requester,
+        {},
+        {"name": name, "url": f"{repo.url}/labels/{quote(name)}"},
+        completed=False,
+    )
+
+
+def apply_label_plan(repo, plan):
+    """
+    Apply the planned label changes to the given repository.
+
+    @param repo: the repo on which the labels are being synced
+    @param plan: the plan computed by plan_repo_labels
+    """
+    LOG.info(
+        f"Syncing labels for repo '{repo.name}' (create:"
+        f" {len(plan['create'])}, update: {len(plan['update'])}, delete:"
+        f" {len(plan['delete'])})..."
+    )
+    LOG.change_indent(+1)
+    for label_name in plan["delete"]:
+        LOG.info(f"Deleting '{label_name}'...")
+        get_label(repo, label_name).delete()
+        LOG.success("done.")
+    for label in plan["create"]:
+        LOG.info(f"Creating '{label.name}'...")
+        repo.create_label(**label._asdict())
+        LOG.success("done.")
+    for label_name, label in plan["update"]:
+        LOG.info(f"Updating '{label.name}'...")
+        get_label(repo, label_name).edit(**label._asdict())
         LOG.success("done.")
     LOG.change_indent(-1)
     LOG.success("done.")
 
 
-def set_labels(repos, standard_labels, repo_specific_labels):
+def set_labels(
+    repos,
+    standard_labels,
+    repo_specific_labels,
+    github_gql_client=None,
+    executor=None,
+):
     """
-    Set labels on all repos for the organisation. This is the main entrypoint
-    of the module.
+    Set labels on all repos for the organisation. The current labels of all
+    repos are read up front and REST API calls are only made for the repos,
+    and the labels, that require changes.
+
+    @param repos: the repos on which to set the labels
+    @param standard_labels: the list of labels that apply to every repo
+    @param repo_specific_labels: the dict mapping repo names to the lists of
+        labels that apply to them
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @param executor: the RepoExecutor with which to apply the changes
+        (optional)
+
+    This is the main entrypoint of the module.
     """
-    for repo in list(repos):
-        LOG.info(f"Getting labels for repo '{repo.name}'...")
-        labels = standard_labels + repo_specific_labels.get(repo.name, [])
-        LOG.success(f"done. Found {len(labels)} labels.")
-        LOG.info(f"Syncing labels for repo '{repo.name}'...")
-        map_repo_to_labels(repo, labels)
-        LOG.success("done.")
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    if executor is None:
+        executor = RepoExecutor()
+    repos = list(repos)
+    remote_labels = get_remote_labels(
+        github_gql_client, [repo.name for repo in repos]
+    )
+
+    LOG.info("Planning label changes...")
+    table = get_label_catalogue().table
+    standard_rows = [table[label.qualified_name] for label in standard_labels]
+    plans = []
+    for repo in repos:
+        labels = standard_rows + [
+            table[label.qualified_name]
+            for label in repo_specific_labels.get(repo.name, [])
+        ]
+        plan = plan_repo_labels(remote_labels.get(repo.name, {}), labels)
+        if any(plan.values()):
+            plans.append((repo, plan))
+    LOG.success(
+        f"done. {len(plans)} of {len(repos)} repos require label changes."
+    )
+
+    executor.map("Syncing labels", apply_label_plan, plans)
 
 
 __all__ = ["set_labels"]
@@ -4,9 +4,19 @@ import logging
 # Third-party
 import yaml
 
+# First-party/Local
+from ccos.gh_utils import (
+    GITHUB_ORGANIZATION,
+    gql_query,
+    setup_github_gql_client,
+)
+from ccos.parallel import RepoExecutor
+
 TRIAGE_LABEL = "🚦 status: awaiting triage"
 LABEL_WORK_REQUIRED_LABEL = "🏷 status: label work required"
 LOG = logging.root
+# GitHub search returns at most 1,000 results per query
+SEARCH_RESULT_LIMIT = 1000
 
 
 def dump_invalid_issues(invalid_issues):
@@ -17,8 +27,8 @@ def dump_invalid_issues(invalid_issues):
     for invalid_issue_list in invalid_issues.values():
         for invalid_issue in invalid_issue_list:
             issue = invalid_issue["issue"]
-            invalid_issue["issue"] = issue.title
-            invalid_issue["url"] = issue.html_url
+            invalid_issue["issue"] = issue["title"]
+            invalid_issue["url"] = issue["url"]
 
     LOG.info("Dumping issues in a file...")
     with open("/tmp/invalid_issues.yml", "w") as file:
@@ -26,89 +36,230 @@ def dump_invalid_issues(invalid_issues):
     LOG.success("done.")
 
 
-def are_issue_labels_valid(issue, required_label_groups):
+def get_open_issues(github_gql_client):
+    """
+    Get all open issues and pull requests, with their labels, across the whole
+    organization using paginated GraphQL searches. As a search returns at most
+    1,000 results, results are sorted by creation date and the search is
+    repeated for older items until all of them have been retrieved.
+
+    @param github_gql_client: the GitHub GraphQL API client
+    @return: the dict mapping repo names to their list of open issues, each of
+        which is a dict with the keys number, title, url, labels (a set of
+        label names) and is_pr
+    """
+    LOG.info("Searching for open issues and pull requests...")
+    query = gql_query(
+        """
+        query($cursor: String, $search_query: String!) {
+            search(
+                after: $cursor
+                first: 100
+                query: $search_query
+                type: ISSUE
+            ) {
+                issueCount
+                nodes {
+                    __typename
+                    ... on Issue {
+                        createdAt
+                        id
+                        labels(first: 100) {
+                            nodes {
+                                name
+                            }
+                        }
+                        number
+                        repository {
+                            name
+                        }
+                        title
+                        url
+                    }
+                    ... on PullRequest {
+                        createdAt
+                        id
+                        number
+                        repository {
+                            name
+                        }
+                        title
+                        url
+                    }
+                }
+                pageInfo {
+                    endCursor
+                    hasNextPage
+                }
+            }
+        }
+        """
+    )
+    search_query_base = (
+        f"org:{GITHUB_ORGANIZATION} state:open sort:created-desc"
+    )
+    nodes = {}
+    created_before = None
+    while True:
+        search_query = search_query_base
+        if created_before:
+            search_query = f"{search_query} created:<={created_before}"
+        cursor = None
+        next_page = True
+        window = []
+        while next_page is True:
+            params = {"cursor": cursor, "search_query": search_query}
+            result = github_gql_client.execute(query, variable_values=params)
+            window += result["search"]["nodes"]
+            cursor = result["search"]["pageInfo"]["endCursor"]
+            next_page = result["search"]["pageInfo"]["hasNextPage"]
+        for node in window:
+            nodes[node["id"]] = node
+        if result["search"]["issueCount"] <= SEARCH_RESULT_LIMIT or not window:
+            break
+        created_before = window[-1]["createdAt"]
+
+    repo_issues = {}
+    for node in nodes.values():
+        issue = {
+            "number": node["number"],
+            "title": node["title"],
+            "url": node["url"],
+            "is_pr": node["__typename"] == "PullRequest",
+            "labels": set(),
+        }
+        if not issue["is_pr"]:
+            for label_node in node["labels"]["nodes"]:
+                issue["labels"].add(label_node["name"])
+        repo = node["repository"]["name"]
+        repo_issues.setdefault(repo, []).append(issue)
+    for issues in repo_issues.values():
+        issues.sort(key=lambda issue: issue["number"], reverse=True)
+    LOG.success(f"done. Found {len(nodes)} issues and pull requests.")
+    return repo_issues
+
+
+def are_issue_labels_valid(issue, required_label_index, labels_valid):
     """
     Check if the given issue is valid based on the labels applied to it.
     @param issue: the issue whose labels are being validated
-    @param required_label_groups: the label groups which must be applied on all
-        issues
+    @param required_label_index: the RequiredLabelIndex of the label groups
+        which must be applied on all issues
+    @param labels_valid: whether the labels satisfy all required groups (see
+        RequiredLabelIndex.validate_many)
     @return: whether the issues is or isn't valid, and why
     """
-    labels = issue.get_labels()
-    label_names = {label.name for label in labels}
-    if issue.pull_request:
-        LOG.log(logging.INFO, f"Skipping '{issue.title}' because it is a PR.")
+    label_names = issue["labels"]
+    if issue["is_pr"]:
+        LOG.log(
+            logging.INFO, f"Skipping '{issue['title']}' because it is a PR."
+        )
         return True, None  # PRs are exempt
     if TRIAGE_LABEL in label_names:
         LOG.log(
             logging.INFO,
-            f"Skipping '{issue.title}' because it is awaiting triage.",
+            f"Skipping '{issue['title']}' because it is awaiting triage.",
         )
         return True, None  # Issues that haven't been triaged are exempt
 
-    missing_label_groups = []
-    for group in required_label_groups:
-        required_labels = {label.qualified_name for label in group.labels}
-        if not label_names.intersection(required_labels):
-            missing_label_groups.append(group.name)
-    if missing_label_groups:
-        issue.add_to_labels(LABEL_WORK_REQUIRED_LABEL)
-        LOG.info(f"Issue '{issue.title}' has missing labels.")
+    if labels_valid:
+        LOG.info(f"Issue '{issue['title']}' is OK.")
+        return True, None
+    else:
+        missing_label_groups = required_label_index.get_missing_groups(
+            label_names
+        )
+        LOG.info(f"Issue '{issue['title']}' has missing labels.")
         return (
             False,
             "Missing labels from label groups:"
             f" {', '.join(missing_label_groups)}",
         )
-    else:
-        LOG.info(f"Issue '{issue.title}' is OK.")
-        return True, None
 
 
-def get_invalid_issues_in_repo(repo, required_label_groups):
+def get_invalid_issues_in_repo(repo, issues, required_label_index):
     """
     Get a list of invalid issues in the given repo with the reason for marking
-    them as such.
+    them as such. Invalid issues that do not have the label work required
+    label yet are labelled with it.
     @param repo: the repo in which to check for the validity of issues
-    @param required_label_groups: the label groups which must be applied on all
-        issues
+    @param issues: the open issues of the repo (see get_open_issues)
+    @param required_label_index: the RequiredLabelIndex of the label groups
+        which must be applied on all issues
     @return: a list of invalid issues and their causes
     """
-    LOG.info(f"Getting issues for repo '{repo.name}'...")
-    issues = repo.get_issues(state="open")
-    LOG.success("done.")
-
     invalid_issues = []
+    all_labels_valid = required_label_index.validate_many(
+        issue["labels"] for issue in issues
+    )
     LOG.change_indent(+1)
-    for issue in issues:
-        LOG.info(f"Checking labels on '{issue.title}'...")
+    for issue, labels_valid in zip(issues, all_labels_valid):
+        LOG.info(f"Checking labels on '{issue['title']}'...")
         are_valid, reason = are_issue_labels_valid(
-            issue, required_label_groups
+            issue, required_label_index, labels_valid
         )
         if not are_valid:
+            if LABEL_WORK_REQUIRED_LABEL not in issue["labels"]:
+                repo.get_issue(issue["number"]).add_to_labels(
+                    LABEL_WORK_REQUIRED_LABEL
+                )
             invalid_issues.append({"issue": issue, "reason": reason})
         LOG.success("done.")
     LOG.change_indent(-1)
     return invalid_issues
 
 
-def validate_issues(repos, required_label_groups):
+def validate_repo_issues(repo, issues, required_label_index):
+    """
+    Validate the labels on all open issues of the given repo.
+    @param repo: the repo whose issues to validate
+    @param issues: the open issues of the repo (see get_open_issues)
+    @param required_label_index: the RequiredLabelIndex of the label groups
+        which must be applied on all issues
+    @return: a list of invalid issues and their causes
+    """
+    LOG.info(f"Checking issues in repo '{repo.name}'...")
+    invalid_issues = get_invalid_issues_in_repo(
+        repo, issues, required_label_index
+    )
+    LOG.success("done.")
+    return invalid_issues
+
+
+def validate_issues(
+    repos, required_label_index, github_gql_client=None, executor=None
+):
     """
     Validate the labels on all issues in all public repos for the organisation.
+    The open issues of all repos are retrieved up front with a few GraphQL
+    searches and REST API calls are only made to label invalid issues.
+
+    @param repos: the repos whose issues to validate
+    @param required_label_index: the RequiredLabelIndex of the label groups
+        which must be applied on all issues
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @param executor: the RepoExecutor with which to process the repos
+        (optional)
 
     This is the main entrypoint of the module.
     """
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    if executor is None:
+        executor = RepoExecutor()
     LOG.info("Finding issues with invalid labels...")
-    invalid_issues = {}
+    repo_issues = get_open_issues(github_gql_client)
+    arguments = []
     LOG.change_indent(+1)
     for repo in list(repos):
         if repo.private:
             LOG.info(f"{repo.name}: skipping: repository is private")
         else:
-            LOG.info(f"Checking issues in repo '{repo.name}'...")
-            invalid_issues[repo.name] = get_invalid_issues_in_repo(
-                repo, required_label_groups
-            )
-            LOG.success("done.")
+            issues = repo_issues.get(repo.name, [])
+            arguments.append((repo, issues, required_label_index))
+    invalid_issues = executor.map(
+        "Checking issues", validate_repo_issues, arguments
+    )
     LOG.change_indent(-1)
     LOG.success("done.")
 
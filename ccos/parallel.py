@@ -0,0 +1,159 @@
+# Standard library
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.root
+# Number of REST API requests kept in reserve: once the remaining rate limit
+# falls to this value, no new repository is started until the limit resets
+RATE_LIMIT_RESERVE = 100
+
+
+class RateLimitBudget:
+    """
+    Share the REST API rate limit among all workers. PyGithub tracks the
+    remaining budget, and the time at which it resets, from the X-RateLimit-*
+    headers of every response. Before each repository is processed, the
+    budget is checked and, if it is nearly exhausted, all workers wait for the
+    reset.
+    """
+
+    def __init__(self, github_rest_client, reserve=RATE_LIMIT_RESERVE):
+        self.github_rest_client = github_rest_client
+        self.reserve = reserve
+        self.lock = threading.Lock()
+
+    def get_remaining(self):
+        """
+        Get the number of REST API requests remaining in the current window.
+        @return: the number of remaining requests
+        """
+        remaining, _ = self.github_rest_client.rate_limiting
+        return remaining
+
+    def wait(self):
+        """
+        Wait for the rate limit to reset if the remaining budget has fallen to
+        the reserve.
+        """
+        with self.lock:
+            remaining = self.get_remaining()
+            if remaining > self.reserve:
+                return
+            reset_time = self.github_rest_client.rate_limiting_resettime
+            delay = max(reset_time - time.time(), 0) + 1
+            LOG.warning(
+                f"REST API rate limit nearly exhausted ({remaining} requests"
+                f" remaining): waiting {delay:.0f} seconds for it to reset"
+            )
+            time.sleep(delay)
+
+
+class RepoExecutor:
+    """
+    Run per-repository steps, either one repository after another or, with
+    more than one worker, concurrently on a thread pool. The logs of each
+    repository are buffered and written out together once it is done, and the
+    outcome of every step is recorded for the final summary.
+    """
+
+    def __init__(self, workers=1, budget=None):
+        self.workers = workers
+        self.budget = budget
+        self.steps = {}
+
+    def run(self, level, buffer, function, arguments):
+        """
+        Run the function for a single repository, recording any exception
+        instead of raising it.
+        @param level: the indentation level of the logs (see map)
+        @param buffer: whether to buffer the logs
+        @param function: the function to run
+        @param arguments: the tuple of arguments, the first being the repo
+        @return: whether the function succeeded and its result (None if it
+            failed)
+        """
+        repo = arguments[0]
+        with LOG.worker(level, buffer=buffer):
+            if self.budget is not None:
+                self.budget.wait()
+            try:
+                result = function(*arguments)
+            except Exception:
+                LOG.error(
+                    f"{repo.name}: unhandled exception:"
+                    f" {traceback.format_exc()}"
+                )
+                return False, None
+        return True, result
+
+    def map(self, step, function, arguments):
+        """
+        Run the function once per repository and record the outcome.
+        @param step: the name of the step (for the summary)
+        @param function: the function to run
+        @param arguments: the list of tuples of arguments, one per call. The
+            first argument of each tuple is the repo
+        @return: the dict mapping the names of the repos for which the function
+            succeeded to its result
+        """
+        # Logs of the function line up with those of a plain loop in the caller
+        level = LOG.get_indent_level(stacklevel=2)
+        results = {}
+        failed = []
+        if self.workers > 1 and len(arguments) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [
+                    pool.submit(self.run, level, True, function, args)
+                    for args in arguments
+                ]
+                outcomes = [future.result() for future in futures]
+        else:
+            outcomes = [
+                self.run(level, False, function, args) for args in arguments
+            ]
+        for args, (succeeded, result) in zip(arguments, outcomes):
+            if succeeded:
+                results[args[0].name] = result
+            else:
+                failed.append(args[0].name)
+        step_succeeded, step_failed = self.steps.setdefault(step, (0, []))
+        self.steps[step] = (
+            step_succeeded + len(results),
+            step_failed + failed,
+        )
+        return results
+
+    @property
+    def failed(self):
+        """
+        Get whether any step failed for any repository.
+        @return: whether there were any failures
+        """
+        return any(failed for _, failed in self.steps.values())
+
+    def log_summary(self):
+        """
+        Log the number of repositories processed, and those that failed, for
+        each step along with the remaining REST API rate limit.
+        """
+        LOG.info("Summary:")
+        with LOG.indented():
+            for step, (succeeded, failed) in self.steps.items():
+                if failed:
+                    LOG.error(
+                        f"{step}: {succeeded} repos succeeded, {len(failed)}"
+                        f" failed: {', '.join(sorted(failed))}"
+                    )
+                else:
+                    LOG.success(f"{step}: {succeeded} repos succeeded")
+            if self.budget is not None:
+                LOG.info(
+                    "REST API requests remaining:"
+                    f" {self.budget.get_remaining()}"
+                )
+
+
+__all__ = ["RateLimitBudget", "RepoExecutor"]
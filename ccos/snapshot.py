@@ -0,0 +1,460 @@
+# Standard library
+import gzip
+import json
+import logging
+import os
+import time
+
+# Third-party
+from github.Repository import Repository
+
+# First-party/Local
+from ccos.cache import get_cache_dir, write_atomic
+from ccos.gh_utils import (
+    GITHUB_ORGANIZATION,
+    gql_query,
+    setup_github_gql_client,
+)
+from ccos.gql_batch import execute_aliased
+
+LOG = logging.root
+# Selection set of a repository, shared by the full crawl and the refresh
+REPOSITORY_FIELDS = """
+    createdAt
+    databaseId
+    defaultBranchRef {
+        name
+    }
+    description
+    homepageUrl
+    id
+    isArchived
+    isFork
+    isPrivate
+    languages(first: 100) {
+        edges {
+            node {
+                name
+            }
+            size
+        }
+    }
+    licenseInfo {
+        id
+        key
+        name
+        spdxId
+    }
+    name
+    nameWithOwner
+    object(expression: "HEAD:.cc-metadata.yml") {
+        ... on Blob {
+            oid
+        }
+    }
+    primaryLanguage {
+        name
+    }
+    pushedAt
+    updatedAt
+    url
+    visibility
+"""
+FIELD_REPOSITORY = f"""
+    repository(owner: $owner, name: $name) {{
+        {REPOSITORY_FIELDS}
+    }}
+"""
+VARIABLES_REPOSITORY = {"owner": "String!", "name": "String!"}
+# Bump whenever the structure of the snapshot changes so that snapshots
+# written by older versions of the code are ignored
+SNAPSHOT_VERSION = 3
+# Snapshots older than this (in seconds) are refreshed. May be overridden with
+# the CCOS_SNAPSHOT_MAX_AGE environment variable
+SNAPSHOT_MAX_AGE_DEFAULT = 15 * 60
+# Refreshing only picks up changes that move the updatedAt or pushedAt
+# watermarks of a repository, so the organization is crawled in full again
+# once the last full crawl is older than this (in seconds)
+SNAPSHOT_FULL_CRAWL_AGE = 24 * 60 * 60
+# Snapshot already loaded or crawled by this process
+SNAPSHOT = {}
+
+
+def get_snapshot_path():
+    return get_cache_dir("snapshot").joinpath(
+        f"{GITHUB_ORGANIZATION}.v{SNAPSHOT_VERSION}.json.gz"
+    )
+
+
+def get_max_age():
+    return int(
+        os.environ.get("CCOS_SNAPSHOT_MAX_AGE", SNAPSHOT_MAX_AGE_DEFAULT)
+    )
+
+
+def paginate(github_gql_client, query, params, get_connection):
+    """
+    Get all nodes (or edges) of a paginated connection.
+    @param github_gql_client: the GitHub GraphQL API client
+    @param query: the query, which must accept a $cursor variable
+    @param params: the other variable values of the query
+    @param get_connection: the function returning the connection from the
+        result of the query
+    @return: the list of nodes (or edges)
+    """
+    items = []
+    cursor = params.pop("cursor", None)
+    next_page = True
+    while next_page is True:
+        result = github_gql_client.execute(
+            query, variable_values={**params, "cursor": cursor}
+        )
+        connection = get_connection(result)
+        items += connection.get("nodes", connection.get("edges", []))
+        cursor = connection["pageInfo"]["endCursor"]
+        next_page = connection["pageInfo"]["hasNextPage"]
+    return items
+
+
+def get_license(license_info):
+    """
+    Convert the license of a repository to the shape of the REST API.
+    @param license_info: the licenseInfo node from the GraphQL API (or None)
+    @return: the license dict (or None)
+    """
+    if license_info is None:
+        return None
+    return {
+        "key": license_info["key"],
+        "name": license_info["name"],
+        "spdx_id": license_info["spdxId"],
+        "url": (
+            f"https://api.github.com/licenses/{license_info['key']}"
+            if license_info["key"] != "other"
+            else None
+        ),
+        "node_id": license_info["id"],
+    }
+
+
+def get_repo_record(node):
+    """
+    Convert a repository node to a snapshot record. The record has the shape
+    of the REST API representation of a repository, so that PyGithub objects
+    can be created from it, plus a "ccos" key with the data that is not part
+    of that representation.
+    @param node: the repository node from the GraphQL API
+    @return: the repository record
+    """
+    name = node["name"]
+    language = node["primaryLanguage"]
+    default_branch = node["defaultBranchRef"]
+    metadata_blob = node["object"]
+    return {
+        "id": node["databaseId"],
+        "node_id": node["id"],
+        "name": name,
+        "full_name": node["nameWithOwner"],
+        "owner": {"login": GITHUB_ORGANIZATION, "type": "Organization"},
+        "html_url": node["url"],
+        "url": f"https://api.github.com/repos/{node['nameWithOwner']}",
+        "description": node["description"],
+        "homepage": node["homepageUrl"],
+        "language": language["name"] if language else None,
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "pushed_at": node["pushedAt"],
+        "archived": node["isArchived"],
+        "private": node["isPrivate"],
+        "fork": node["isFork"],
+        "visibility": node["visibility"].lower(),
+        "default_branch": default_branch["name"] if default_branch else None,
+        "license": get_license(node["licenseInfo"]),
+        "ccos": {
+            "cc_metadata_oid": metadata_blob["oid"] if metadata_blob else None,
+            "languages": {
+                edge["node"]["name"]: edge["size"]
+                for edge in node["languages"]["edges"]
+            },
+        },
+    }
+
+
+def crawl_repos(github_gql_client):
+    """
+    Crawl all repositories of the organization.
+    @param github_gql_client: the GitHub GraphQL API client
+    @return: the list of repository records, sorted by name
+    """
+    query = gql_query(
+        f"""
+        query($cursor: String, $organization: String!) {{
+            organization(login: $organization) {{
+                repositories(after: $cursor, first: 50) {{
+                    nodes {{
+                        {REPOSITORY_FIELDS}
+                    }}
+                    pageInfo {{
+                        endCursor
+                        hasNextPage
+                    }}
+                }}
+            }}
+        }}
+        """
+    )
+    nodes = paginate(
+        github_gql_client,
+        query,
+        {"organization": GITHUB_ORGANIZATION},
+        lambda result: result["organization"]["repositories"],
+    )
+    records = [get_repo_record(node) for node in nodes]
+    return sorted(records, key=lambda record: record["name"])
+
+
+def get_watermarks(github_gql_client):
+    """
+    Get the watermarks of all repositories of the organization: the times at
+    which they were last updated and pushed to. Only these two fields are
+    requested, so a page of 100 repositories costs a single point of the rate
+    limit.
+    @param github_gql_client: the GitHub GraphQL API client
+    @return: the list of repository nodes with the fields id, name, pushedAt
+        and updatedAt
+    """
+    query = gql_query(
+        """
+        query($cursor: String, $organization: String!) {
+            organization(login: $organization) {
+                repositories(after: $cursor, first: 100) {
+                    nodes {
+                        id
+                        name
+                        pushedAt
+                        updatedAt
+                    }
+                    pageInfo {
+                        endCursor
+                        hasNextPage
+                    }
+                }
+            }
+        }
+        """
+    )
+    return paginate(
+        github_gql_client,
+        query,
+        {"organization": GITHUB_ORGANIZATION},
+        lambda result: result["organization"]["repositories"],
+    )
+
+
+def refresh_repos(github_gql_client, records):
+    """
+    Refresh the repository records of a previous crawl. Only the repositories
+    whose watermarks changed since that crawl (and new or renamed ones) are
+    fetched again, with batched GraphQL queries. Deleted repositories are
+    dropped.
+    @param github_gql_client: the GitHub GraphQL API client
+    @param records: the repository records of the previous crawl
+    @return: the list of repository records, sorted by name, and the number
+        of repositories that were fetched again
+    """
+    previous = {record["node_id"]: record for record in records}
+    refreshed = []
+    changed = []
+    for node in get_watermarks(github_gql_client):
+        record = previous.get(node["id"])
+        if (
+            record is not None
+            and record["name"] == node["name"]
+            and record["updated_at"] == node["updatedAt"]
+            and record["pushed_at"] == node["pushedAt"]
+        ):
+            refreshed.append(record)
+        else:
+            changed.append((node["name"], record))
+    items = [
+        (name, {"owner": GITHUB_ORGANIZATION, "name": name})
+        for name, _ in changed
+    ]
+    results, failures = execute_aliased(
+        github_gql_client,
+        "query",
+        FIELD_REPOSITORY,
+        VARIABLES_REPOSITORY,
+        items,
+    )
+    refreshed += [
+        get_repo_record(node) for node in results.values() if node is not None
+    ]
+    for name, record in changed:
+        if name in failures:
+            LOG.warning(
+                f"{name}: unable to refresh repo: {'; '.join(failures[name])}"
+            )
+            # Keeping the old watermarks makes the next refresh try again
+            if record is not None:
+                refreshed.append(record)
+    return sorted(refreshed, key=lambda record: record["name"]), len(changed)
+
+
+def save_snapshot(snapshot):
+    write_atomic(
+        get_snapshot_path(),
+        gzip.compress(json.dumps(snapshot).encode("utf-8")),
+    )
+
+
+def crawl_snapshot(github_gql_client):
+    """
+    Crawl the organization and write the snapshot to the cache directory.
+    @param github_gql_client: the GitHub GraphQL API client
+    @return: the snapshot
+    """
+    LOG.info("Crawling organization snapshot...")
+    now = time.time()
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "organization": GITHUB_ORGANIZATION,
+        "created": now,
+        "refreshed": now,
+        "repos": crawl_repos(github_gql_client),
+    }
+    save_snapshot(snapshot)
+    LOG.success(f"done. Found {len(snapshot['repos'])} repos.")
+    return snapshot
+
+
+def refresh_snapshot(github_gql_client, snapshot):
+    """
+    Refresh the given snapshot and write it to the cache directory. Only the
+    repositories that changed since the snapshot was last refreshed are
+    fetched again (see refresh_repos).
+    @param github_gql_client: the GitHub GraphQL API client
+    @param snapshot: the snapshot to refresh (not modified)
+    @return: the refreshed snapshot
+    """
+    LOG.info("Refreshing organization snapshot...")
+    now = time.time()
+    repos, changed = refresh_repos(github_gql_client, snapshot["repos"])
+    snapshot = {
+        **snapshot,
+        "refreshed": now,
+        "repos": repos,
+    }
+    save_snapshot(snapshot)
+    LOG.success(f"done. Fetched {changed} of {len(repos)} repos again.")
+    return snapshot
+
+
+def load_snapshot():
+    """
+    Load the snapshot from the cache directory unless it is missing or was
+    written by another version of the code.
+    @return: the snapshot (or None)
+    """
+    path = get_snapshot_path()
+    if not path.exists():
+        return None
+    with gzip.open(path, "rt") as file_obj:
+        snapshot = json.load(file_obj)
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def get_snapshot(github_gql_client=None, max_age=None):
+    """
+    Get the snapshot of the organization: all repositories, with their
+    languages, license and .cc-metadata.yml blob OID. The snapshot is shared
+    by all scripts (and steps) that run within max_age of each other. Once it
+    is older, it is refreshed: only the repositories whose updatedAt or
+    pushedAt watermarks moved are fetched again. The whole organization is
+    crawled with a few paginated GraphQL queries if there is no snapshot yet
+    or if the last full crawl is older than a day.
+
+    The returned snapshot is shared and must not be modified.
+
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @param max_age: the maximum age in seconds of a snapshot to reuse without
+        refreshing it (defaults to CCOS_SNAPSHOT_MAX_AGE or 15 minutes)
+    @return: the snapshot dict with the keys version, organization, created,
+        refreshed and repos
+    """
+    if max_age is None:
+        max_age = get_max_age()
+    snapshot = SNAPSHOT.get("snapshot")
+    if snapshot is None:
+        snapshot = load_snapshot()
+    now = time.time()
+    if snapshot is not None and now - snapshot["refreshed"] <= max_age:
+        if "snapshot" not in SNAPSHOT:
+            age = now - snapshot["refreshed"]
+            LOG.info(f"Using organization snapshot from {age:.0f} seconds ago")
+        SNAPSHOT["snapshot"] = snapshot
+        return snapshot
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    if snapshot is None or now - snapshot["created"] > SNAPSHOT_FULL_CRAWL_AGE:
+        snapshot = crawl_snapshot(github_gql_client)
+    else:
+        snapshot = refresh_snapshot(github_gql_client, snapshot)
+    SNAPSHOT["snapshot"] = snapshot
+    return snapshot
+
+
+def get_repos(requester, snapshot=None):
+    """
+    Get PyGithub Repository objects for all repositories in the snapshot. The
+    objects are built from the snapshot without any request; like those
+    returned by Organization.get_repos, they are only completed with a REST
+    API request if an attribute missing from the snapshot is accessed.
+    @param requester: the PyGithub requester of the REST client (available as
+        the requester attribute of any PyGithub object)
+    @param snapshot: the snapshot (optional, see get_snapshot)
+    @return: the list of Repository objects, sorted by name
+    """
+    if snapshot is None:
+        snapshot = get_snapshot()
+    return [
+        Repository(requester, {}, record, completed=False)
+        for record in snapshot["repos"]
+    ]
+
+
+def get_repo_names(snapshot=None):
+    """
+    Get the names of all repositories in the snapshot.
+    @param snapshot: the snapshot (optional, see get_snapshot)
+    @return: the list of repository names, sorted
+    """
+    if snapshot is None:
+        snapshot = get_snapshot()
+    return [record["name"] for record in snapshot["repos"]]
+
+
+def get_cc_metadata_oids(snapshot=None):
+    """
+    Get the object IDs of the .cc-metadata.yml files of all repositories in
+    the snapshot (see ccos.metadata.get_cc_metadata).
+    @param snapshot: the snapshot (optional, see get_snapshot)
+    @return: the dict mapping repository names to the object IDs of their
+        metadata files (None for repositories without one)
+    """
+    if snapshot is None:
+        snapshot = get_snapshot()
+    return {
+        record["name"]: record["ccos"]["cc_metadata_oid"]
+        for record in snapshot["repos"]
+    }
+
+
+__all__ = [
+    "get_cc_metadata_oids",
+    "get_repo_names",
+    "get_repos",
+    "get_snapshot",
+]
@@ -0,0 +1,77 @@
+# REST API permissions that include write/push access
+PUSH_PERMISSIONS = {"admin", "maintain", "push"}
+
+
+class TeamPermissionMatrix:
+    """
+    Teams of the organization and their permissions on its repositories, keyed
+    by team slug and held in memory so that they can be looked up without any
+    request. The matrix is built from the team crawl of set_teams_on_github
+    (a single paginated GraphQL query) and is kept up to date with the teams
+    it then creates and the permissions it writes, so that it can be shared
+    with the CODEOWNERS sync.
+    """
+
+    def __init__(self, permissions=None):
+        """
+        @param permissions: the dict mapping team slugs to dicts mapping repo
+            names to the REST API permission of the team on the repo
+        """
+        self.permissions = {
+            slug: dict(repos) for slug, repos in (permissions or {}).items()
+        }
+
+    @classmethod
+    def from_team_states(cls, teams):
+        """
+        Build the matrix from the current state of the teams.
+        @param teams: the dict mapping team slugs to their TeamState (see
+            set_teams_on_github.get_ct_teams)
+        @return: the TeamPermissionMatrix
+        """
+        return cls({slug: state.repos for slug, state in teams.items()})
+
+    def has_team(self, team_slug):
+        """
+        Get whether the team exists.
+        @param team_slug: the slug of the team
+        @return: whether the team is in the matrix
+        """
+        return team_slug in self.permissions
+
+    def add_team(self, team_slug):
+        """
+        Record a new team, without any permission.
+        @param team_slug: the slug of the team
+        """
+        self.permissions.setdefault(team_slug, {})
+
+    def get(self, team_slug, repo_name):
+        """
+        Get the permission of the team on the repo.
+        @param team_slug: the slug of the team
+        @param repo_name: the name of the repo
+        @return: the REST API permission (None if the team has no access)
+        """
+        return self.permissions.get(team_slug, {}).get(repo_name)
+
+    def set(self, team_slug, repo_name, permission):
+        """
+        Record the permission of the team on the repo.
+        @param team_slug: the slug of the team
+        @param repo_name: the name of the repo
+        @param permission: the REST API permission
+        """
+        self.permissions.setdefault(team_slug, {})[repo_name] = permission
+
+    def can_push(self, team_slug, repo_name):
+        """
+        Get whether the team has write/push permissions on the repo.
+        @param team_slug: the slug of the team
+        @param repo_name: the name of the repo
+        @return: whether the team can push to the repo
+        """
+        return self.get(team_slug, repo_name) in PUSH_PERMISSIONS
+
+
+__all__ = ["TeamPermissionMatrix"]
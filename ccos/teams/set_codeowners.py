@@ -1,22 +1,27 @@
 # Standard library
 import datetime
+import difflib
 import logging
 import os
 from pathlib import Path
-from tempfile import TemporaryDirectory
 
 # Third-party
-import git
-from github.GithubException import UnknownObjectException
+from github import InputGitAuthor, InputGitTreeElement
 
 # First-party/Local
 from ccos.gh_utils import (
     GITHUB_ORGANIZATION,
     get_cc_organization,
-    get_credentials,
+    get_team_slug_name,
+    setup_github_gql_client,
     setup_github_rest_client,
 )
-from ccos.teams.set_teams_on_github import map_role_to_team
+from ccos.git_cache import worktree
+from ccos.gql_batch import execute_aliased
+from ccos.parallel import RateLimitBudget, RepoExecutor
+from ccos.snapshot import get_repos
+from ccos.teams.permissions import TeamPermissionMatrix
+from ccos.teams.set_teams_on_github import PERMISSIONS, get_ct_teams
 
 CODEOWNERS_TEMPLATE = """\
 # https://help.github.com/en/articles/about-code-owners
@@ -25,41 +30,136 @@ CODEOWNERS_TEMPLATE = """\
 # line, the pattern matches only the last mentioned code owner.
 * @creativecommons/technology
 """
+CODEOWNERS_PATH = ".github/CODEOWNERS"
+COMMIT_MESSAGE = "Sync Community Team(s) to CODEOWNERS"
+FIELD_CODEOWNERS = f"""
+    repository(owner: $owner, name: $name) {{
+        defaultBranchRef {{
+            target {{
+                oid
+            }}
+        }}
+        object(expression: "HEAD:{CODEOWNERS_PATH}") {{
+            ... on Blob {{
+                text
+            }}
+        }}
+    }}
+"""
 GIT_USER_NAME = "CC creativecommons.github.io Bot"
 GIT_USER_EMAIL = "cc-creativecommons-github-io-bot@creativecommons.org"
 LOG = logging.root
 SYNC_BRANCH = "ct_codeowners"
+VARIABLES_CODEOWNERS = {"owner": "String!", "name": "String!"}
 
 
-def create_codeowners_for_data(args, databag):
-    set_up_git_user()
-    github_client = setup_github_rest_client()
+def create_codeowners_for_data(
+    args, databag, github_gql_client=None, permissions=None
+):
+    """
+    Add the community teams of each project to the CODEOWNERS files of its
+    repos. By default, the files are read with batched GraphQL queries and
+    changes are committed with the Git Data API, so repos that are up to date
+    cost no more than their share of a query. With args.clone, each repo is
+    checked out and changes are pushed with git instead. Up to args.workers
+    repos are checked concurrently. The permissions of the teams on the repos
+    are looked up in memory.
+
+    @param args: the command line arguments (debug, clone and workers)
+    @param databag: the community team databag
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @param permissions: the TeamPermissionMatrix of the community teams
+        (optional, see create_teams_for_data)
+    @return: whether all repos were checked successfully
+    """
+    clone = getattr(args, "clone", False)
+    workers = getattr(args, "workers", 1)
+    if clone:
+        set_up_git_user()
+    github_client = setup_github_rest_client(pool_size=workers)
     organization = get_cc_organization(github_client)
+    gh_repos = {repo.name: repo for repo in get_repos(organization.requester)}
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    if permissions is None:
+        _, teams = get_ct_teams(github_gql_client)
+        permissions = TeamPermissionMatrix.from_team_states(teams)
+    if not clone:
+        codeowners = get_codeowners_files(
+            github_gql_client,
+            sorted(
+                {
+                    repo_name
+                    for project in databag["projects"]
+                    for repo_name in project["repos"]
+                }
+            ),
+        )
 
-    LOG.info("Identifying and fixing CODEOWNER issues...")
+    # Repos shared by several projects are checked once with the teams of all
+    # of them, as each check replaces the community teams of the file
+    repo_teams = {}
     projects = sorted(databag["projects"], key=lambda d: d["name"])
     for project in projects:
         project_name = project["name"]
-        LOG.info(
-            "Identifying and fixing CODEOWNER issues for project"
-            f" {project_name}...",
-        )
-
-        LOG.info("Finding all teams...")
+        LOG.info(f"Finding all teams for project {project_name}...")
         roles = project["roles"]
-        teams = get_teams(organization, project_name, roles)
+        teams = get_teams(project_name, roles, permissions)
         LOG.info(
             f"Found {len(teams)} teams for project {project_name}.",
         )
+        for repo_name in project["repos"]:
+            repo_teams.setdefault(repo_name, []).extend(teams)
+
+    checks = []
+    missing = []
+    for repo_name, teams in sorted(repo_teams.items()):
+        if repo_name not in gh_repos or (
+            not clone and repo_name not in codeowners
+        ):
+            LOG.error(f"Repository not found: {repo_name}")
+            missing.append(repo_name)
+        elif clone:
+            checks.append((gh_repos[repo_name], args, teams, permissions))
+        else:
+            checks.append(
+                (gh_repos[repo_name], args, teams, permissions, codeowners)
+            )
 
-        LOG.info("Checking all projects...")
-        repos = sorted(project["repos"])
-        with TemporaryDirectory() as temp_dir:
-            for repo_name in repos:
-                check_and_fix_repo(
-                    args, organization, repo_name, teams, temp_dir
-                )
+    LOG.info("Identifying and fixing CODEOWNER issues...")
+    executor = RepoExecutor(
+        workers=workers, budget=RateLimitBudget(github_client)
+    )
+    if clone:
+        pull_requests = executor.map(
+            "Checking CODEOWNERS", check_and_fix_repo, checks
+        )
+    else:
+        pull_requests = executor.map(
+            "Checking CODEOWNERS", check_and_fix_repo_via_api, checks
+        )
+    log_report(pull_requests, missing)
+    executor.log_summary()
     LOG.success("Done")
+    return not executor.failed and not missing
+
+
+def log_report(pull_requests, missing):
+    """
+    Log the PRs opened for the repos whose CODEOWNERS file needed a fix.
+    @param pull_requests: the dict mapping the names of the checked repos to
+        the URL of the PR opened for them (None if none was needed)
+    @param missing: the names of the repos that were not found
+    """
+    opened = {
+        repo_name: url for repo_name, url in pull_requests.items() if url
+    }
+    LOG.info(f"Opened {len(opened)} PRs:")
+    with LOG.indented():
+        for repo_name, url in sorted(opened.items()):
+            LOG.info(f"{repo_name}: {url}")
+    if missing:
+        LOG.error(f"Repositories not found: {', '.join(sorted(missing))}")
 
 
 def set_up_git_user():
@@ -75,78 +175,200 @@ def set_up_git_user():
     os.environ["GIT_COMMITTER_EMAIL"] = GIT_USER_EMAIL
 
 
-def get_teams(organization, project_name, roles):
+def get_teams(project_name, roles, permissions):
     """
     Get all teams corresponding to the Community Team roles for the project.
     Roles with no permissions do not form teams on GitHub and therefore will
-    not be represented in the resulting list.
+    not be included. The teams are looked up in the permission matrix, so no
+    request is made and teams that do not exist are left out.
 
-    @param organization: the organization whole teams are being fetched
     @param project_name: the project whose teams are being fetching
     @param roles: the filled roles in the project
-    @return: the list of GitHub teams for all Community Team roles
+    @param permissions: the TeamPermissionMatrix of the community teams
+    @return: the list of team slugs for all Community Team roles
     """
-    role_team_map = {
-        role: map_role_to_team(organization, project_name, role, False)
-        for role in roles.keys()
-    }
     teams = []
-    for team in role_team_map.values():
-        if team:
-            teams.append(team)
+    for role in roles:
+        if PERMISSIONS[role] is None:
+            continue
+        team_slug, _ = get_team_slug_name(project_name, role)
+        if permissions.has_team(team_slug):
+            teams.append(team_slug)
     return teams
 
 
-def check_and_fix_repo(args, organization, repo_name, teams, temp_dir):
+def check_and_fix_repo(gh_repo, args, teams, permissions):
     """
     Identify issues with the CODEOWNERS file and rectify them. Missing
     CODEOWNERS files will be created. Incomplete CODEOWNERS files will be
-    have new entries appended to them.
+    have new entries appended to them. The repo is checked out in a worktree
+    of its cached mirror (see ccos.git_cache).
+
+    @param gh_repo: the repo to which the CODEOWNERS file being modified
+        belongs
+    @param args: the command line arguments
+    @param teams: the list of slugs of the community teams of the projects
+        of the repo
+    @param permissions: the TeamPermissionMatrix of the community teams
+    @return: the URL of the PR opened for the fix (None if none was opened)
+    """
 
-    @param organization: the organization to which the repository belongs
-    @param repo: the repo to which the CODEOWNERS file being modified belongs
+    LOG.info(f"Checking and fixing {gh_repo.name}...")
+    pr_url = None
+    with worktree(gh_repo.name) as local_repo:
+        codeowners_path = Path(
+            os.path.join(local_repo.working_dir, ".github", "CODEOWNERS")
+        )
+        fix_required = False
+
+        if not codeowners_path.exists():
+            fix_required = True
+            LOG.info("CODEOWNERS does not exist, creating...")
+            os.makedirs(codeowners_path.parent, exist_ok=True)
+            with open(codeowners_path, "w") as codeowners_file:
+                codeowners_file.write(CODEOWNERS_TEMPLATE)
+            LOG.success("done.")
+
+        teams = filter_valid_teams(gh_repo, teams, permissions)
+        fix_required = (
+            add_missing_teams(codeowners_path, teams) or fix_required
+        )
+
+        if fix_required:
+            branch_name = create_branch(local_repo)
+            commit_or_display_changes(args, local_repo, codeowners_path)
+            push_changes(args, local_repo, branch_name)
+            pr_url = create_pull_request(args, gh_repo, branch_name)
+
+    LOG.success("done.")
+    return pr_url
+
+
+def get_codeowners_files(github_gql_client, repo_names):
+    """
+    Get the CODEOWNERS files of the given repos, along with the commits they
+    were read from, with batched GraphQL queries.
+    @param github_gql_client: the GitHub GraphQL API client
+    @param repo_names: the names of the repos
+    @return: the dict mapping repo names to (head commit OID, CODEOWNERS text)
+        pairs. The text is None for repos without a CODEOWNERS file
     """
+    LOG.info("Fetching CODEOWNERS files...")
+    items = [
+        (repo_name, {"owner": GITHUB_ORGANIZATION, "name": repo_name})
+        for repo_name in repo_names
+    ]
+    results, failures = execute_aliased(
+        github_gql_client,
+        "query",
+        FIELD_CODEOWNERS,
+        VARIABLES_CODEOWNERS,
+        items,
+    )
+    for repo_name, messages in failures.items():
+        LOG.warning(
+            f"{repo_name}: unable to fetch {CODEOWNERS_PATH}:"
+            f" {'; '.join(messages)}"
+        )
+    files = {}
+    for repo_name, repository in results.items():
+        if repository is None or repository["defaultBranchRef"] is None:
+            continue
+        blob = repository["object"] or {}
+        files[repo_name] = (
+            repository["defaultBranchRef"]["target"]["oid"],
+            blob.get("text"),
+        )
+    LOG.success("done.")
+    return files
 
+
+def check_and_fix_repo_via_api(gh_repo, args, teams, permissions, codeowners):
+    """
+    Identify issues with the CODEOWNERS file and rectify them without cloning
+    the repo. The new file is computed in memory and, only if it differs, is
+    committed to a new branch with the Git Data API and proposed in a PR.
+
+    @param gh_repo: the repo to check
+    @param args: the command line arguments
+    @param teams: the list of slugs of the community teams of the projects
+        of the repo
+    @param permissions: the TeamPermissionMatrix of the community teams
+    @param codeowners: the CODEOWNERS files (see get_codeowners_files)
+    @return: the URL of the PR opened for the fix (None if none was opened)
+    """
+    repo_name = gh_repo.name
     LOG.info(f"Checking and fixing {repo_name}...")
-    repo_dir = os.path.join(temp_dir, repo_name)
-    try:
-        gh_repo = organization.get_repo(repo_name)
-    except UnknownObjectException:
-        LOG.error(f"Repository not found: {repo_name}")
-        raise
-    clone_url = get_github_repo_url_with_credentials(repo_name)
-    local_repo = set_up_repo(clone_url, repo_dir)
-    codeowners_path = Path(os.path.join(repo_dir, ".github", "CODEOWNERS"))
+    pr_url = None
+    head_oid, text = codeowners[repo_name]
     fix_required = False
-
-    if not codeowners_path.exists():
+    if text is None:
         fix_required = True
         LOG.info("CODEOWNERS does not exist, creating...")
-        os.makedirs(codeowners_path.parent, exist_ok=True)
-        with open(codeowners_path, "w") as codeowners_file:
-            codeowners_file.write(CODEOWNERS_TEMPLATE)
-        LOG.success("done.")
+        text = CODEOWNERS_TEMPLATE
 
-    teams = filter_valid_teams(gh_repo, teams)
-    fix_required = add_missing_teams(codeowners_path, teams)
+    teams = filter_valid_teams(gh_repo, teams, permissions)
+    lines, lines_changed = add_missing_teams_to_lines(
+        text.splitlines(keepends=True), teams
+    )
+    new_text = "".join(lines)
+    fix_required = fix_required or lines_changed
 
     if fix_required:
-        branch_name = create_branch(local_repo)
-        commit_or_display_changes(args, local_repo, codeowners_path)
-        push_changes(args, local_repo, branch_name)
-        create_pull_request(args, gh_repo, branch_name)
+        if args.debug:
+            diff = difflib.unified_diff(
+                (codeowners[repo_name][1] or "").splitlines(keepends=True),
+                lines,
+                f"a/{CODEOWNERS_PATH}",
+                f"b/{CODEOWNERS_PATH}",
+            )
+            LOG.debug("".join(diff))
+        branch_name = get_branch_name()
+        commit_via_api(args, gh_repo, head_oid, new_text, branch_name)
+        pr_url = create_pull_request(args, gh_repo, branch_name)
 
     LOG.success("done.")
+    return pr_url
+
+
+def commit_via_api(args, gh_repo, head_oid, text, branch_name):
+    """
+    Commit the new CODEOWNERS file on top of the given commit and create a
+    branch pointing to the commit, using the Git Data API.
+
+    @param args: the command line arguments
+    @param gh_repo: PyGithub Repository object
+    @param head_oid: the OID of the commit from which the file was read
+    @param text: the new contents of the CODEOWNERS file
+    @param branch_name: the name of the branch to create
+    """
+    if args.debug:
+        LOG.debug("Skipping: Committing via the GitHub API")
+        return
+    LOG.info("Committing via the GitHub API...")
+    base_commit = gh_repo.get_git_commit(head_oid)
+    tree = gh_repo.create_git_tree(
+        [InputGitTreeElement(CODEOWNERS_PATH, "100644", "blob", content=text)],
+        base_commit.tree,
+    )
+    author = InputGitAuthor(GIT_USER_NAME, GIT_USER_EMAIL)
+    commit = gh_repo.create_git_commit(
+        COMMIT_MESSAGE, tree, [base_commit], author, author
+    )
+    gh_repo.create_git_ref(f"refs/heads/{branch_name}", commit.sha)
+    LOG.success(f"Pushed to {branch_name}.")
 
 
-def filter_valid_teams(gh_repo, teams):
+def filter_valid_teams(gh_repo, teams, permissions):
     """
-    Remove teams that do not have write/push permissions.
+    Leave out teams that do not have write/push permissions. The given list,
+    which is shared by the repos of a project, is left unchanged.
+    @param gh_repo: PyGithub Repository object
+    @param teams: the list of team slugs
+    @param permissions: the TeamPermissionMatrix of the community teams
+    @return: the new list of team slugs that can push to the repo
     """
-    for index, team in enumerate(teams):
-        if not team.get_repo_permission(gh_repo).push:
-            del teams[index]
-    return teams
+    return [team for team in teams if permissions.can_push(team, gh_repo.name)]
 
 
 def create_branch(local_repo):
@@ -161,19 +383,23 @@ def create_branch(local_repo):
                        CODEOWNERS file being modified belongs
     @return: the name of the branch to which the changes were pushed
     """
-    timestamp = int(datetime.datetime.now().timestamp())
-    branch_name = f"{SYNC_BRANCH}_{timestamp}"
+    branch_name = get_branch_name()
     local_repo.git.checkout("HEAD", b=branch_name)
 
     return branch_name
 
 
+def get_branch_name():
+    timestamp = int(datetime.datetime.now().timestamp())
+    return f"{SYNC_BRANCH}_{timestamp}"
+
+
 def commit_or_display_changes(args, local_repo, codeowners_path):
     local_repo.index.add(items=codeowners_path)
     if args.debug:
         LOG.debug(local_repo.git.diff(staged=True))
     else:
-        local_repo.index.commit(message="Sync Community Team(s) to CODEOWNERS")
+        local_repo.index.commit(message=COMMIT_MESSAGE)
 
 
 def push_changes(args, local_repo, branch_name):
@@ -194,9 +420,11 @@ def create_pull_request(args, gh_repo, branch_name):
     @param gh_repo: PyGithub Repository object
     @param branch_name: the name of the branch containing the CODEOWNERS
                         changes
+    @return: the URL of the PR (None in debug mode)
     """
     if args.debug:
         LOG.debug("Skipping: Opening a PR")
+        return None
     else:
         LOG.info("Opening a PR...")
         pr = gh_repo.create_pull(
@@ -210,36 +438,45 @@ def create_pull_request(args, gh_repo, branch_name):
             base=gh_repo.default_branch,
         )
         LOG.success(f"PR at {pr.url}.")
+        return pr.html_url
 
 
-def set_up_repo(clone_url, repo_dir):
+def add_missing_teams(codeowners_path, teams):
     """
-    Clone the repository and pull the main branch.
+    Add the mention forms for all missing teams in a new line.
 
-    @param clone_url: the authenticated URL to the GitHub repo
-    @param repo_dir: the local directory for the repository
-    @return: GitPython Repo instance
+    @param codeowners_path: the path of the CODEOWNERS file
+    @param team_mention_map: the dictionary of team slugs and their mentions
     """
-    LOG.info("Cloning repo...")
-    local_repo = git.Repo.clone_from(url=clone_url, to_path=repo_dir)
-    return local_repo
+    with open(codeowners_path, "r") as codeowners_file:
+        new_codeowners = codeowners_file.readlines()
+    new_codeowners, fix_required = add_missing_teams_to_lines(
+        new_codeowners, teams
+    )
+    if fix_required:
+        LOG.info("CODEOWNERS is incomplete, populating...")
+        with open(codeowners_path, "w") as codeowners_file:
+            codeowners_file.writelines(new_codeowners)
+        LOG.success("done.")
+    return fix_required
 
 
-def add_missing_teams(codeowners_path, teams):
+def add_missing_teams_to_lines(codeowners_lines, teams):
     """
-    Add the mention forms for all missing teams in a new line.
+    Add the mention forms for all missing teams to the catch-all lines of the
+    given CODEOWNERS contents.
 
-    @param codeowners_path: the path of the CODEOWNERS file
-    @param team_mention_map: the dictionary of team slugs and their mentions
+    @param codeowners_lines: the lines of the CODEOWNERS file (with their
+        line endings)
+    @param teams: the list of community team slugs
+    @return: the new list of lines and whether any line changed
     """
     fix_required = False
     community_teams = []
     for team in teams:
-        community_teams.append(f"@{GITHUB_ORGANIZATION}/{team.slug}")
+        community_teams.append(f"@{GITHUB_ORGANIZATION}/{team}")
     community_teams.sort()
-    new_codeowners = []
-    with open(codeowners_path, "r") as codeowners_file:
-        new_codeowners = codeowners_file.readlines()
+    new_codeowners = list(codeowners_lines)
     for index, line in enumerate(new_codeowners):
         if not line.startswith("* "):
             continue
@@ -253,24 +490,4 @@ def add_missing_teams(codeowners_path, teams):
         if line.strip() != new_line.strip():
             new_codeowners[index] = new_line
             fix_required = True
-    if fix_required:
-        LOG.info("CODEOWNERS is incomplete, populating...")
-        with open(codeowners_path, "w") as codeowners_file:
-            codeowners_file.writelines(new_codeowners)
-        LOG.success("done.")
-    return fix_required
-
-
-def get_github_repo_url_with_credentials(repo_name):
-    """
-    Get the HTTPS URL to the repository which has the username and a GitHub
-    token for authentication.
-
-    @param repo_name: the name of the repository
-    @return: the authenticated URL to the GitHub repo
-    """
-    github_username, github_token = get_credentials()
-    return (
-        f"https://{github_username}:{github_token}"
-        f"@github.com/{GITHUB_ORGANIZATION}/{repo_name}.git"
-    )
+    return new_codeowners, fix_required
@@ -1,16 +1,24 @@
 # Standard library
 import logging
 import sys
+from collections import namedtuple
 
 # Third-party
-from github import UnknownObjectException
+from github import GithubException
+from github.Team import Team
 
 # First-party/Local
 from ccos.gh_utils import (
+    GITHUB_ORGANIZATION,
     get_cc_organization,
     get_team_slug_name,
+    gql_query,
+    setup_github_gql_client,
     setup_github_rest_client,
 )
+from ccos.snapshot import get_repo_names, paginate
+from ccos.teams.permissions import TeamPermissionMatrix
+from ccos.users import get_named_user, invalidate_users, resolve_users
 
 LOG = logging.root
 PERMISSIONS = {
@@ -19,150 +27,307 @@ PERMISSIONS = {
     "Project Core Committer": "push",
     "Project Maintainer": "maintain",
 }
+# GraphQL enum values and their REST API equivalents
+PRIVACY = {"SECRET": "secret", "VISIBLE": "closed"}
+REPOSITORY_PERMISSIONS = {
+    "ADMIN": "admin",
+    "MAINTAIN": "maintain",
+    "WRITE": "push",
+    "TRIAGE": "triage",
+    "READ": "pull",
+}
+# Current state of a team: its name, description and privacy, the dict
+# mapping the names of its repos to its permission on them and the set of
+# the (lowercase) logins of its members and invitees
+TeamState = namedtuple(
+    "TeamState", ["name", "description", "privacy", "repos", "members"]
+)
+# Changes required to bring a team in line with the databag: the properties
+# to edit (or to create the team with), the dict mapping the names of the
+# repos to add or update to the permission to set, the number of repos whose
+# permission is already up to date and the logins of the members to add and
+# remove
+TeamPlan = namedtuple(
+    "TeamPlan",
+    [
+        "slug",
+        "name",
+        "properties",
+        "repos",
+        "repos_unchanged",
+        "add_members",
+        "remove_members",
+    ],
+)
 
 
-def create_teams_for_data(databag):
-    client = setup_github_rest_client()
-    organization = get_cc_organization(client)
-
-    LOG.info("Creating and populating teams...")
-    projects = databag["projects"]
-    for project in projects:
-        project_name = project["name"]
-        logging.log(
-            logging.INFO,
-            f"Creating and populating teams for project {project_name}...",
-        )
-        roles = project["roles"]
-        for role, members in roles.items():
-            if PERMISSIONS[role] is None:
-                logging.log(
-                    logging.INFO, f"Skipping {role} as it has no privileges."
-                )
-                continue
-
-            LOG.info(f"Finding team for role {role}...")
-            team = map_role_to_team(organization, project_name, role)
-            LOG.success("done.")
+def get_ct_teams(github_gql_client):
+    """
+    Get all community teams (whose slug starts with ct-) along with their
+    repos, the permission of the team on each, their members and their
+    pending invitations. The teams are filtered by GitHub, so the other teams
+    of the organization are not fetched.
+    @param github_gql_client: the GitHub GraphQL API client
+    @return: the login of the authenticated user and the dict mapping team
+        slugs to their TeamState
+    """
+    query = gql_query(
+        """
+        query($cursor: String, $organization: String!) {
+            viewer {
+                login
+            }
+            organization(login: $organization) {
+                teams(after: $cursor, first: 25, query: "ct-") {
+                    nodes {
+                        description
+                        invitations(first: 100) {
+                            nodes {
+                                invitee {
+                                    login
+                                }
+                            }
+                        }
+                        members(first: 100, membership: IMMEDIATE) {
+                            nodes {
+                                login
+                            }
+                            pageInfo {
+                                endCursor
+                                hasNextPage
+                            }
+                        }
+                        name
+                        privacy
+                        repositories(first: 100) {
+                            edges {
+                                node {
+                                    name
+                                }
+                                permission
+                            }
+                            pageInfo {
+                                endCursor
+                                hasNextPage
+                            }
+                        }
+                        slug
+                    }
+                    pageInfo {
+                        endCursor
+                        hasNextPage
+                    }
+                }
+            }
+        }
+        """
+    )
+    LOG.info("Fetching community teams...")
+    viewer = {}
 
-            LOG.info(f"Populating repos for team {team.name}...")
-            repos = project["repos"]
-            map_team_to_repos(organization, team, repos, True)
-            set_team_repo_permissions(team, PERMISSIONS[role])
-            LOG.success("done.")
+    def get_connection(result):
+        viewer.update(result["viewer"])
+        return result["organization"]["teams"]
 
-            LOG.info(f"Populating members for team {team.name}...")
-            members = [member["github"] for member in members]
-            map_team_to_members(client, team, members, True)
-            LOG.success("done.")
-        LOG.success("done.")
-    LOG.success("done.")
+    nodes = paginate(
+        github_gql_client,
+        query,
+        {"organization": GITHUB_ORGANIZATION},
+        get_connection,
+    )
+    teams = {}
+    for node in nodes:
+        # The query also matches teams with "ct-" elsewhere in their name or
+        # slug
+        if not node["slug"].startswith("ct-"):
+            continue
+        edges = node["repositories"]["edges"]
+        if node["repositories"]["pageInfo"]["hasNextPage"]:
+            edges += get_more_team_connection(
+                github_gql_client, node, "repositories"
+            )
+        members = node["members"]["nodes"]
+        if node["members"]["pageInfo"]["hasNextPage"]:
+            members += get_more_team_connection(
+                github_gql_client, node, "members"
+            )
+        invitees = [
+            invitation["invitee"]["login"]
+            for invitation in node["invitations"]["nodes"]
+            if invitation["invitee"]
+        ]
+        teams[node["slug"]] = TeamState(
+            name=node["name"],
+            description=node["description"],
+            privacy=PRIVACY[node["privacy"]],
+            repos={
+                edge["node"]["name"]: REPOSITORY_PERMISSIONS[
+                    edge["permission"]
+                ]
+                for edge in edges
+            },
+            members={
+                login.lower()
+                for login in [member["login"] for member in members] + invitees
+            },
+        )
+    LOG.success(f"done. Found {len(teams)} community teams.")
+    return viewer["login"], teams
 
 
-def map_team_to_members(
-    client, team, final_user_logins, non_destructive=False
-):
+def get_more_team_connection(github_gql_client, node, connection):
     """
-    Map the team to the given set of members. Any members that are not already
-    a part of the team will be added and any additional members that are a part
-    of the team will be removed, unless chosen not to.
-
-    @param client: the GitHub client
-    @param team: the Team object representing the team
-    @param final_user_logins: the list of users to associate with the team
-    @param non_destructive: whether to trim extra repos or preserve them
+    Get the repository edges or the member nodes of a team beyond the first
+    page.
+    @param github_gql_client: the GitHub GraphQL API client
+    @param node: the team node from the GraphQL API
+    @param connection: "repositories" or "members"
+    @return: the list of the remaining edges or nodes
     """
-    initial_users = team.get_members()
-    initial_user_logins = [user.login for user in initial_users]
+    query = gql_query(
+        """
+        query(
+            $cursor: String
+            $members: Boolean!
+            $organization: String!
+            $slug: String!
+        ) {
+            organization(login: $organization) {
+                team(slug: $slug) {
+                    members(after: $cursor, first: 100, membership: IMMEDIATE)
+                        @include(if: $members) {
+                        nodes {
+                            login
+                        }
+                        pageInfo {
+                            endCursor
+                            hasNextPage
+                        }
+                    }
+                    repositories(after: $cursor, first: 100)
+                        @skip(if: $members) {
+                        edges {
+                            node {
+                                name
+                            }
+                            permission
+                        }
+                        pageInfo {
+                            endCursor
+                            hasNextPage
+                        }
+                    }
+                }
+            }
+        }
+        """
+    )
+    return paginate(
+        github_gql_client,
+        query,
+        {
+            "cursor": node[connection]["pageInfo"]["endCursor"],
+            "members": connection == "members",
+            "organization": GITHUB_ORGANIZATION,
+            "slug": node["slug"],
+        },
+        lambda result: result["organization"]["team"][connection],
+    )
 
-    if not non_destructive:
-        users_to_drop = [
-            member
-            for member in initial_users
-            if member.login not in final_user_logins
-        ]
-        for user in users_to_drop:
-            team.remove_membership(user)
-
-    for login in final_user_logins:
-        if login not in initial_user_logins:
-            try:
-                user = client.get_user(login)
-            except UnknownObjectException:
-                LOG.info(f"ERROR: User not found: {login}")
-                sys.exit(1)
-            team.add_membership(user)
-
-    current_login = client.get_user().login
-    if current_login not in final_user_logins:
-        current_user = client.get_user(current_login)
-        team.remove_membership(current_user)
-
-
-def map_team_to_repos(
-    organization, team, final_repo_names, non_destructive=False
-):
-    """
-    Map the team to the given set of repositories. Any repositories that are
-    not already a part of the team will be added and any additional
-    repositories that are a part of the team will be removed, unless chosen not
-    to.
 
-    @param organization: the Organisation object of which the team is a part
-    @param team: the Team object representing the team
-    @param final_repo_names: the list of repo names to associate with the team
-    @param non_destructive: whether to trim extra repos or preserve them
+def plan_team(project, role, members, state, viewer_login, repo_names):
     """
-    initial_repos = team.get_repos()
-    initial_repo_names = [repo.name for repo in initial_repos]
-
-    if not non_destructive:
-        repos_to_drop = [
-            repo for repo in initial_repos if repo.name not in final_repo_names
-        ]
-        for repo in repos_to_drop:
-            team.remove_from_repos(repo)
-
-    repos_to_add = [
-        organization.get_repo(repo_name)
-        for repo_name in final_repo_names
-        if repo_name not in initial_repo_names
-    ]
-    for repo in repos_to_add:
-        team.add_to_repos(repo)
+    Plan the changes that bring the team of the given role in the given
+    project in line with the databag. Changes are additive: repos and members
+    that are not in the databag are kept, except for the authenticated user,
+    who is added to every team it creates.
+    @param project: the project from the databag
+    @param role: the role held by folks in the team
+    @param members: the list of GitHub logins of the members of the team
+    @param state: the current TeamState (None if the team does not exist)
+    @param viewer_login: the login of the authenticated user
+    @param repo_names: the set of the names of all repos of the organization
+    @return: the TeamPlan
+    """
+    project_name = project["name"]
+    permission = PERMISSIONS[role]
+    team_slug, team_name = get_team_slug_name(project_name, role)
+    properties = get_team_properties(project_name, role)
+    if state is None:
+        # The authenticated user becomes a member of the teams it creates
+        state = TeamState(team_name, None, None, {}, {viewer_login.lower()})
+    else:
+        properties = {
+            key: value
+            for key, value in properties.items()
+            if value != getattr(state, key)
+        }
+        if properties:
+            properties["name"] = team_name
+    repos, repos_unchanged = plan_team_repo_permissions(
+        team_name, state.repos, project["repos"], permission, repo_names
+    )
+    logins = {login.lower() for login in members}
+    return TeamPlan(
+        slug=team_slug,
+        name=team_name,
+        properties=properties,
+        repos=repos,
+        repos_unchanged=repos_unchanged,
+        add_members=[
+            login for login in members if login.lower() not in state.members
+        ],
+        remove_members=(
+            [viewer_login]
+            if viewer_login.lower() in state.members
+            and viewer_login.lower() not in logins
+            else []
+        ),
+    )
 
 
-def set_team_repo_permissions(team, permission):
+def plan_team_repo_permissions(
+    team_name, current_permissions, project_repo_names, permission, repo_names
+):
     """
-    Set the given permission for each repository belonging to the team. The
-    permissions are determined by the role corresponding to team.
-
-    @param team: the team to update the permissions for
-    @param permission: the permission to set on each repo assigned to the team
+    Plan the permission writes for the repos of a team. Every repo of the
+    project, and every repo the team already has access to, should have the
+    permission of the role; writes are only planned for those whose current
+    permission differs.
+    @param team_name: the name of the team (for the log)
+    @param current_permissions: the dict mapping the names of the repos of
+        the team to its current permission on them
+    @param project_repo_names: the names of the repos of the project
+    @param permission: the permission of the role (see PERMISSIONS)
+    @param repo_names: the set of the names of all repos of the organization
+    @return: the dict mapping the names of the repos to write to the
+        permission to set and the number of repos that are up to date
     """
-    repos = team.get_repos()
-    for repo in repos:
-        logging.log(
-            logging.INFO,
-            f"Populating {permission} permission on {repo.full_name} repo...",
-        )
-        team.set_repo_permission(repo, permission)
-        LOG.success("done.")
+    target_repo_names = set(current_permissions)
+    for repo_name in project_repo_names:
+        if repo_name in repo_names:
+            target_repo_names.add(repo_name)
+        else:
+            LOG.warning(f"{team_name}: skipping unknown repo {repo_name}")
+    writes = {}
+    unchanged = 0
+    for repo_name in sorted(target_repo_names):
+        if current_permissions.get(repo_name) == permission:
+            unchanged += 1
+        else:
+            writes[repo_name] = permission
+    return writes, unchanged
 
 
-def map_role_to_team(organization, project_name, role, create_if_absent=True):
+def get_team_properties(project_name, role):
     """
-    Map the given role in the given project to a team. Creates the team if one
-    such does not already exist.
-
-    @param organization: the Organisation object of which the team is a part
+    Get the properties a team should have.
     @param project_name: the name of the project to which the team belongs
     @param role: the role held by folks in the team
-    @param create_if_absent: whether to create the team if it does not exist
-    @return: the team associated with the role
+    @return: the dict of the name, description and privacy of the team
     """
-    team_slug, team_name = get_team_slug_name(project_name, role)
-    properties = {
+    _, team_name = get_team_slug_name(project_name, role)
+    return {
         "name": team_name,
         "description": (
             f"Community Team for {project_name} "
@@ -170,25 +335,151 @@ def map_role_to_team(organization, project_name, role, create_if_absent=True):
         ),
         "privacy": "closed",
     }
-    try:
-        team = organization.get_team_by_slug(team_slug)
-    except UnknownObjectException:
-        team = None
-    if team:
-        LOG.info(f"Team exists ({team_name}), reconciling...")
-        if team.description == properties["description"]:
-            del properties["description"]
-        if team.privacy == properties["privacy"]:
-            del properties["privacy"]
-        if properties and properties != {"name": team.name}:
-            team.edit(**properties)
-        LOG.success("done.")
+
+
+def get_team(organization, slug):
+    """
+    Get a Team object for the team with the given slug without any request.
+    @param organization: the Organisation object of which the team is a part
+    @param slug: the slug of the team
+    @return: the Team object
+    """
+    return Team(
+        organization.requester,
+        {},
+        {
+            "slug": slug,
+            "url": f"{organization.url}/teams/{slug}",
+            "organization": {
+                "login": organization.login,
+                "url": organization.url,
+            },
+        },
+        completed=False,
+    )
+
+
+def apply_team_plan(organization, plan, exists, permissions):
+    """
+    Make the REST API calls of the given plan.
+    @param organization: the Organisation object of which the team is a part
+    @param plan: the TeamPlan to apply
+    @param exists: whether the team exists
+    @param permissions: the TeamPermissionMatrix, updated with the team if it
+        is created and with the repo permissions that are written
+    @return: the number of repo permission writes that were applied
+    """
+    if not exists:
+        LOG.info(f"{plan.name}: creating team")
+        team = organization.create_team(**plan.properties)
+        permissions.add_team(plan.slug)
     else:
-        if not create_if_absent:
-            LOG.info("Did not exist, not creating.")
-            team = None
+        team = get_team(organization, plan.slug)
+        if plan.properties:
+            LOG.info(f"{plan.name}: updating team")
+            team.edit(**plan.properties)
+    applied = 0
+    for repo_name, permission in plan.repos.items():
+        LOG.info(
+            f"{plan.name}: setting {permission} permission on {repo_name}"
+        )
+        if team.update_team_repository(
+            f"{GITHUB_ORGANIZATION}/{repo_name}", permission
+        ):
+            permissions.set(plan.slug, repo_name, permission)
+            applied += 1
         else:
-            LOG.info("Did not exist, creating...")
-            team = organization.create_team(**properties)
-            LOG.success("done.")
-    return team
+            LOG.warning(
+                f"{plan.name}: unable to set {permission} permission on"
+                f" {repo_name}"
+            )
+    for login in plan.add_members:
+        LOG.info(f"{plan.name}: adding {login}")
+        try:
+            team.add_membership(get_named_user(organization.requester, login))
+        except GithubException:
+            # The user may have been renamed or deleted since it was resolved
+            # and cached, so it is resolved again by the next run
+            invalidate_users([login])
+            raise
+    for login in plan.remove_members:
+        LOG.info(f"{plan.name}: removing {login}")
+        team.remove_membership(get_named_user(organization.requester, login))
+    return applied
+
+
+def create_teams_for_data(databag, github_gql_client=None):
+    """
+    Create and populate the teams of all roles with privileges in all projects
+    of the databag. The current state of all community teams is read up front
+    with paginated GraphQL queries and REST API calls are only made for the
+    teams, repos and members that require changes. All logins of the databag
+    are validated before any team is changed.
+
+    @param databag: the community team databag
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @return: the TeamPermissionMatrix of the community teams, including the
+        teams created and the permissions written by this function
+    """
+    if github_gql_client is None:
+        github_gql_client = setup_github_gql_client()
+    client = setup_github_rest_client()
+    organization = get_cc_organization(client)
+    viewer_login, teams = get_ct_teams(github_gql_client)
+    permissions = TeamPermissionMatrix.from_team_states(teams)
+    repo_names = set(get_repo_names())
+
+    logins = [
+        member["github"]
+        for project in databag["projects"]
+        for role, members in project["roles"].items()
+        if PERMISSIONS[role] is not None
+        for member in members
+    ]
+    users = resolve_users(logins, github_gql_client)
+    unknown_logins = sorted({login for login in logins if not users[login]})
+    if unknown_logins:
+        LOG.critical(
+            f"{len(unknown_logins)} GitHub users not found:"
+            f" {', '.join(unknown_logins)}"
+        )
+        sys.exit(1)
+
+    LOG.info("Planning team changes...")
+    plans = []
+    skipped = 0
+    for project in databag["projects"]:
+        for role, members in project["roles"].items():
+            if PERMISSIONS[role] is None:
+                continue
+            team_slug, _ = get_team_slug_name(project["name"], role)
+            state = teams.get(team_slug)
+            plan = plan_team(
+                project,
+                role,
+                [users[member["github"]] for member in members],
+                state,
+                viewer_login,
+                repo_names,
+            )
+            skipped += plan.repos_unchanged
+            if state is None or any(
+                [
+                    plan.properties,
+                    plan.repos,
+                    plan.add_members,
+                    plan.remove_members,
+                ]
+            ):
+                plans.append((plan, state is not None))
+    LOG.success(f"done. {len(plans)} teams require changes.")
+
+    LOG.info("Creating and populating teams...")
+    applied = 0
+    for plan, exists in plans:
+        applied += apply_team_plan(organization, plan, exists, permissions)
+    LOG.success(
+        f"done. Applied {applied} repo permission writes, skipped"
+        f" {skipped} that were already up to date."
+    )
+    return permissions
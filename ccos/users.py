@@ -0,0 +1,156 @@
+# Standard library
+import json
+import logging
+import os
+import time
+
+# Third-party
+from github.NamedUser import NamedUser
+
+# First-party/Local
+from ccos.cache import get_cache_dir, write_atomic
+from ccos.gh_utils import setup_github_gql_client
+from ccos.gql_batch import execute_aliased
+
+FIELD_USER = """
+    user(login: $login) {
+        login
+    }
+"""
+LOG = logging.root
+# Resolved users are kept in the on-disk cache for this many seconds. May be
+# overridden with the CCOS_USER_CACHE_TTL environment variable (0 disables
+# the on-disk cache)
+USER_CACHE_TTL_DEFAULT = 7 * 24 * 60 * 60
+USER_CACHE_FILE_NAME = "users.json"
+# Error returned by the GraphQL API for logins that do not exist
+USER_NOT_FOUND_MESSAGE = "Could not resolve to a User"
+VARIABLES_USER = {"login": "String!"}
+# Users already resolved by this process: dict mapping lowercase logins to
+# their canonical login (None for unknown logins)
+USERS = {}
+
+
+def get_user_cache_ttl():
+    return int(os.environ.get("CCOS_USER_CACHE_TTL", USER_CACHE_TTL_DEFAULT))
+
+
+def load_cached_users():
+    """
+    Load the users resolved by previous runs from the on-disk cache, leaving
+    out those resolved longer than the TTL ago.
+    @return: the dict mapping lowercase logins to their canonical login and
+        the time at which they were resolved
+    """
+    ttl = get_user_cache_ttl()
+    cache_file = get_cache_dir("users").joinpath(USER_CACHE_FILE_NAME)
+    if ttl <= 0 or not cache_file.exists():
+        return {}
+    with open(cache_file, "r") as file_obj:
+        entries = json.load(file_obj)
+    expiry = time.time() - ttl
+    return {
+        key: (login, resolved)
+        for key, (login, resolved) in entries.items()
+        if resolved >= expiry
+    }
+
+
+def store_cached_users(entries):
+    """
+    Store the resolved users in the on-disk cache. Entries are keyed by the
+    logins of the databag; unknown logins are not stored so that they are
+    checked again by the next run.
+    @param entries: the dict mapping lowercase logins to their canonical
+        login and the time at which they were resolved
+    """
+    if get_user_cache_ttl() <= 0:
+        return
+    cache_file = get_cache_dir("users").joinpath(USER_CACHE_FILE_NAME)
+    write_atomic(cache_file, json.dumps(entries).encode("utf-8"))
+
+
+def resolve_users(logins, github_gql_client=None):
+    """
+    Resolve the given GitHub logins to the canonical logins of the users. The
+    logins that are neither resolved by this process yet nor in the on-disk
+    cache are looked up with batched GraphQL queries.
+    @param logins: the logins to resolve (case-insensitive)
+    @param github_gql_client: the GitHub GraphQL API client (optional)
+    @return: the dict mapping the given logins to the canonical logins of the
+        users (None for logins that do not exist)
+    """
+    missing = sorted({login.lower() for login in logins} - set(USERS))
+    if missing:
+        cached = load_cached_users()
+        lookups = []
+        for key in missing:
+            if key in cached:
+                USERS[key] = cached[key][0]
+            else:
+                lookups.append(key)
+        if lookups:
+            if github_gql_client is None:
+                github_gql_client = setup_github_gql_client()
+            LOG.info(f"Resolving {len(lookups)} GitHub users...")
+            items = [(key, {"login": key}) for key in lookups]
+            results, failures = execute_aliased(
+                github_gql_client, "query", FIELD_USER, VARIABLES_USER, items
+            )
+            now = time.time()
+            for key, user in results.items():
+                USERS[key] = user["login"] if user else None
+                if user:
+                    cached[key] = (user["login"], now)
+            for key, messages in failures.items():
+                if all(USER_NOT_FOUND_MESSAGE in m for m in messages):
+                    USERS[key] = None
+                else:
+                    raise Exception(
+                        f"Unable to resolve GitHub user {key}:"
+                        f" {'; '.join(messages)}"
+                    )
+            store_cached_users(cached)
+            LOG.success("done.")
+    return {login: USERS[login.lower()] for login in logins}
+
+
+def invalidate_users(logins):
+    """
+    Forget the given users, in this process and in the on-disk cache, so that
+    the databag logins that resolved to them are looked up again. This is
+    used when a write for a user fails, as the user may have been renamed or
+    deleted since it was resolved.
+    @param logins: the canonical logins of the users (see resolve_users)
+    """
+    keys = {login.lower() for login in logins}
+    for key, login in list(USERS.items()):
+        if login is not None and login.lower() in keys:
+            del USERS[key]
+    cached = load_cached_users()
+    store_cached_users(
+        {
+            key: (login, resolved)
+            for key, (login, resolved) in cached.items()
+            if login.lower() not in keys
+        }
+    )
+
+
+def get_named_user(requester, login):
+    """
+    Get a NamedUser object for the user with the given (canonical) login
+    without any request.
+    @param requester: the PyGithub requester of the REST client
+    @param login: the login of the user (see resolve_users)
+    @return: the NamedUser object
+    """
+    return NamedUser(
+        requester,
+        {},
+        {"login": login, "url": f"https://api.github.com/users/{login}"},
+        completed=False,
+    )
+
+
+__all__ = ["get_named_user", "invalidate_users", "resolve_users"]
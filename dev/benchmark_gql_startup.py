@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark the GraphQL client startup: setting up the client and validating a
+first query, which used to build the whole GitHub schema from its SDL file.
+Each case runs in a fresh process. Exits with an error if a warm start (with
+the schema and validated documents already cached) exceeds its budget.
+"""
+
+# Standard library
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+DIR_REPO = Path(__file__).resolve().parent.parent
+# Warm starts must stay below this many seconds
+WARM_BUDGET_DEFAULT = 0.1
+RUNS_DEFAULT = 5
+# Each snippet prints the number of seconds taken by the measured code. The
+# imports are left out as they are the same for all cases
+SNIPPET_BASELINE = """
+import time
+from graphql import build_ast_schema, parse
+from ccos.gql_schema import SCHEMA_PATH
+start = time.perf_counter()
+with open(SCHEMA_PATH, "r") as file_obj:
+    build_ast_schema(parse(file_obj.read()))
+print(time.perf_counter() - start)
+"""
+SNIPPET_STARTUP = """
+import time
+from ccos import gh_utils
+start = time.perf_counter()
+gh_utils.setup_github_gql_client()
+gh_utils.gql_query(
+    '''
+    query($login: String!) {
+        organization(login: $login) {
+            repositories(first: 1) {
+                nodes {
+                    name
+                }
+            }
+        }
+    }
+    '''
+)
+print(time.perf_counter() - start)
+"""
+
+
+def measure(snippet, cache_dir):
+    """
+    Run the snippet in a new Python process.
+    @param snippet: the Python code to run
+    @param cache_dir: the cache directory of the process
+    @return: the number of seconds reported by the snippet
+    """
+    environment = {
+        **os.environ,
+        "ADMIN_GITHUB_TOKEN": os.environ.get("ADMIN_GITHUB_TOKEN", "dummy"),
+        "CCOS_CACHE_DIR": cache_dir,
+        "PYTHONPATH": str(DIR_REPO),
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", snippet],
+        capture_output=True,
+        check=True,
+        env=environment,
+        text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument(
+        "--runs",
+        type=int,
+        default=RUNS_DEFAULT,
+        help=f"number of runs of each case (default: {RUNS_DEFAULT})",
+    )
+    ap.add_argument(
+        "--warm-budget",
+        type=float,
+        default=WARM_BUDGET_DEFAULT,
+        help="maximum number of seconds of a warm start (default:"
+        f" {WARM_BUDGET_DEFAULT})",
+    )
+    args = ap.parse_args()
+
+    results = {"baseline (SDL build)": [], "cold start": [], "warm start": []}
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results["baseline (SDL build)"].append(
+                measure(SNIPPET_BASELINE, cache_dir)
+            )
+            results["cold start"].append(measure(SNIPPET_STARTUP, cache_dir))
+            results["warm start"].append(measure(SNIPPET_STARTUP, cache_dir))
+    for case, timings in results.items():
+        print(
+            f"{case:<22} best {min(timings) * 1000:8.1f} ms"
+            f"   worst {max(timings) * 1000:8.1f} ms"
+        )
+    warm = min(results["warm start"])
+    if warm > args.warm_budget:
+        print(
+            f"ERROR: warm start took {warm * 1000:.1f} ms, over the budget of"
+            f" {args.warm_budget * 1000:.1f} ms",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ and and status column.
 
 # Standard library
 import argparse
+import asyncio
 import sys
 import textwrap
 import traceback
@@ -18,10 +19,45 @@ from pygments.lexers import PythonTracebackLexer
 
 # First-party/Local
 import ccos.log
-from ccos import gh_utils
+from ccos import gh_utils, gql_batch
 
 LOG = ccos.log.setup_logger()
+FIELD_ADD_ITEM_TO_PROJECT = """
+    addProjectV2ItemById(
+        input: {
+            projectId: $project_id
+            contentId: $item_id
+        }
+    ) {
+        item {
+            id
+        }
+    }
+"""
+FIELD_SET_STATUS_OPTION = """
+    updateProjectV2ItemFieldValue(
+        input: {
+            fieldId: $field_id
+            itemId: $item_id
+            projectId: $project_id
+            value: {
+                singleSelectOptionId: $option_id
+            }
+        }
+    ) {
+        projectV2Item {
+            id
+        }
+    }
+"""
 PROJECTS_YAML = "ccos/manage/projects.yml"
+VARIABLES_ADD_ITEM_TO_PROJECT = {"project_id": "ID!", "item_id": "ID!"}
+VARIABLES_SET_STATUS_OPTION = {
+    "field_id": "ID!",
+    "item_id": "ID!",
+    "project_id": "ID!",
+    "option_id": "String",
+}
 
 
 def setup():
@@ -44,7 +80,17 @@ def setup():
         action="store_true",
         help="dry run: do not make any changes",
     )
+    ap.add_argument(
+        "--concurrency",
+        default=None,
+        type=int,
+        help="send up to N batches of changes concurrently using the"
+        " asynchronous GitHub GraphQL API client",
+        metavar="N",
+    )
     args = ap.parse_args()
+    if args.concurrency is not None and args.concurrency < 1:
+        ap.error("--concurrency must be at least 1")
     return args
 
 
@@ -209,53 +255,172 @@ def get_untracked_items(github_gql_client):
     return items
 
 
+def get_item_project(project_data, repo):
+    for project in project_data.keys():
+        if repo in project_data[project]["repos"]:
+            return project
+    LOG.error(f"missing project assignment for repository: {repo}")
+    sys.exit(1)
+
+
+def get_add_items(project_data, chunk):
+    add_items = []
+    for repo, number, item_id, project, _, _ in chunk:
+        params = {
+            "project_id": project_data[project]["id"],
+            "item_id": item_id,
+        }
+        add_items.append((f"{repo}#{number}", params))
+    return add_items
+
+
+def get_status_items(project_data, chunk, added):
+    status_items = []
+    for repo, number, _, project, _, option_id in chunk:
+        key = f"{repo}#{number}"
+        if key not in added:
+            continue
+        params = {
+            "field_id": project_data[project]["status_field_id"],
+            "item_id": added[key]["item"]["id"],
+            "project_id": project_data[project]["id"],
+            "option_id": option_id,
+        }
+        status_items.append((key, params))
+    return status_items
+
+
+def log_tracked_items(chunk, add_failures, status_failures):
+    """
+    Log the outcome for each item of the chunk, in order.
+
+    @return: the list of "repo#number" keys of the items that failed
+    """
+    failed = []
+    for repo, number, _, project, status, _ in chunk:
+        key = f"{repo}#{number}"
+        if key in add_failures:
+            LOG.error(
+                f"{key} could not be added to {project} project:"
+                f" {'; '.join(add_failures[key])}"
+            )
+            failed.append(key)
+            continue
+        with LOG.indented():
+            LOG.info(f"{key} added to {project} project")
+            ditto = len(key) * "^"
+            if key in status_failures:
+                LOG.error(
+                    f"{ditto} could not be moved to Status: {status}:"
+                    f" {'; '.join(status_failures[key])}"
+                )
+                failed.append(key)
+            else:
+                # 90 is bright black (gray)
+                LOG.info(
+                    f"\u001b[90m{ditto}\u001b[0m moved to Status: {status}"
+                )
+    return failed
+
+
+def track_chunk(github_gql_client, project_data, chunk):
+    """
+    Add a chunk of items to their projects and move them to their statuses:
+    one aliased request adds the items and a second aliased request sets the
+    status of the ones that were added.
+
+    @param github_gql_client: the GitHub GraphQL API client
+    @param project_data: the project data (see update_project_data)
+    @param chunk: the list of [repo, number, item_id, project, status,
+        option_id] lists of items to add
+    @return: the add failures and the status failures, keyed by "repo#number"
+    """
+    added, add_failures = gql_batch.execute_aliased(
+        github_gql_client,
+        "mutation",
+        FIELD_ADD_ITEM_TO_PROJECT,
+        VARIABLES_ADD_ITEM_TO_PROJECT,
+        get_add_items(project_data, chunk),
+    )
+    _, status_failures = gql_batch.execute_aliased(
+        github_gql_client,
+        "mutation",
+        FIELD_SET_STATUS_OPTION,
+        VARIABLES_SET_STATUS_OPTION,
+        get_status_items(project_data, chunk, added),
+    )
+    return add_failures, status_failures
+
+
+async def track_chunks_async(concurrency, project_data, chunks):
+    """
+    Concurrent variant of track_chunk for a list of chunks. Up to concurrency
+    requests are in flight at once using the asynchronous GitHub GraphQL API
+    client.
+
+    @param concurrency: the maximum number of concurrent requests
+    @param project_data: the project data (see update_project_data)
+    @param chunks: the list of chunks of items (see track_chunk)
+    @return: the list of add failures and status failures, one per chunk
+    """
+    github_gql_client = gh_utils.setup_github_gql_async_client()
+    throttle = gql_batch.AdaptiveThrottle(concurrency)
+    async with github_gql_client as session:
+
+        async def track_chunk_async(chunk):
+            added, add_failures = await gql_batch.execute_aliased_async(
+                session,
+                throttle,
+                "mutation",
+                FIELD_ADD_ITEM_TO_PROJECT,
+                VARIABLES_ADD_ITEM_TO_PROJECT,
+                get_add_items(project_data, chunk),
+            )
+            _, status_failures = await gql_batch.execute_aliased_async(
+                session,
+                throttle,
+                "mutation",
+                FIELD_SET_STATUS_OPTION,
+                VARIABLES_SET_STATUS_OPTION,
+                get_status_items(project_data, chunk, added),
+            )
+            return add_failures, status_failures
+
+        return await asyncio.gather(
+            *[track_chunk_async(chunk) for chunk in chunks]
+        )
+
+
+def add_planned_items(args, github_gql_client, project_data, planned):
+    """
+    Add the planned items to their projects and move them to their statuses,
+    in batches. The items are logged in order, either after each batch or, in
+    concurrent mode, once all batches have completed.
+
+    @return: the list of "repo#number" keys of the items that failed
+    """
+    chunks = gql_batch.chunked(planned)
+    if args.concurrency is not None:
+        results = asyncio.run(
+            track_chunks_async(args.concurrency, project_data, chunks)
+        )
+    else:
+        results = (
+            track_chunk(github_gql_client, project_data, chunk)
+            for chunk in chunks
+        )
+    failed = []
+    for chunk, (add_failures, status_failures) in zip(chunks, results):
+        failed += log_tracked_items(chunk, add_failures, status_failures)
+    return failed
+
+
 def track_items(args, github_gql_client, project_data, items):
     if args.dryrun:
         noop = "dryrun (no-op): "
     else:
         noop = ""
-
-    query_add_item_to_project = gh_utils.gql(
-        """
-        mutation($project_id: ID!, $item_id: ID!) {
-            addProjectV2ItemById(
-                input: {
-                    projectId: $project_id
-                    contentId: $item_id
-                }
-            ) {
-                item {
-                    id
-                }
-            }
-        }
-        """
-    )
-    query_set_status_option = gh_utils.gql(
-        """
-        mutation(
-            $field_id: ID!
-            $item_id: ID!
-            $project_id: ID!
-            $option_id: String
-        ) {
-            updateProjectV2ItemFieldValue(
-                input: {
-                    fieldId: $field_id
-                    itemId: $item_id
-                    projectId: $project_id
-                    value: {
-                        singleSelectOptionId: $option_id
-                    }
-                }
-            ) {
-                projectV2Item {
-                    id
-                }
-            }
-        }
-        """
-    )
+    failed = []
 
     # Add issues to projects
     if args.count is None:
@@ -263,49 +428,23 @@ def track_items(args, github_gql_client, project_data, items):
     else:
         count = min(args.count, len(items["issues"]))
     LOG.info(f"{noop}Adding {count} open and untracked issues to projects")
+    planned = []
     for item in items["issues"][0 : args.count]:  # noqa: E203
         repo, number, _, needs_triage, item_id = item
         # identify appropriate project
-        project_id = None
-        field_id = None
-        for project in project_data.keys():
-            if repo in project_data[project]["repos"]:
-                project_id = project_data[project]["id"]
-                field_id = project_data[project]["status_field_id"]
-                break
-        if not project_id:
-            LOG.error(f"missing project assignment for repository: {repo}")
-            sys.exit(1)
-        # add issue to project
-        if not args.dryrun:
-            params = {"project_id": project_id, "item_id": item_id}
-            result = github_gql_client.execute(
-                query_add_item_to_project, variable_values=params
-            )
-            item_id = result["addProjectV2ItemById"]["item"]["id"]
-            LOG.change_indent(+1)
-            LOG.info(f"{repo}#{number} added to {project} project")
+        project = get_item_project(project_data, repo)
         # move issue to Status: Triage or Backlog
-        if not args.dryrun:
-            if needs_triage:
-                option_id = project_data[project]["status_triage_id"]
-                status = "Triage"
-            else:
-                option_id = project_data[project]["status_backlog_id"]
-                status = "Backlog"
-            params = {
-                "field_id": field_id,
-                "item_id": item_id,
-                "project_id": project_id,
-                "option_id": option_id,
-            }
-            result = github_gql_client.execute(
-                query_set_status_option, variable_values=params
-            )
-            ditto = len(f"{repo}#{number}") * "^"
-            # 90 is bright black (gray)
-            LOG.info(f"\u001b[90m{ditto}\u001b[0m moved to Status: {status}")
-        LOG.change_indent(-1)
+        if needs_triage:
+            option_id = project_data[project]["status_triage_id"]
+            status = "Triage"
+        else:
+            option_id = project_data[project]["status_backlog_id"]
+            status = "Backlog"
+        planned.append([repo, number, item_id, project, status, option_id])
+    if not args.dryrun:
+        failed += add_planned_items(
+            args, github_gql_client, project_data, planned
+        )
 
     # Add pull requests to projects
     if args.count is None:
@@ -315,44 +454,25 @@ def track_items(args, github_gql_client, project_data, items):
     LOG.info(
         f"{noop}Adding {count} open and untracked pull requests to projects"
     )
+    planned = []
     for item in items["prs"][0 : args.count]:  # noqa: E203
         repo, number, _, item_id = item
         # identify appropriate project
-        project_id = None
-        field_id = None
-        for project in project_data.keys():
-            if repo in project_data[project]["repos"]:
-                project_id = project_data[project]["id"]
-                field_id = project_data[project]["status_field_id"]
-                break
-        if not project_id:
-            LOG.error(f"missing project assignment for repository: {repo}")
-            sys.exit(1)
-        # add pull request to project
-        if not args.dryrun:
-            params = {"project_id": project_id, "item_id": item_id}
-            result = github_gql_client.execute(
-                query_add_item_to_project, variable_values=params
-            )
-            item_id = result["addProjectV2ItemById"]["item"]["id"]
-            LOG.change_indent(+1)
-            LOG.info(f"{repo}#{number} added to {project} project")
+        project = get_item_project(project_data, repo)
         # move pull request to Status: In review
-        if not args.dryrun:
-            option_id = project_data[project]["status_in_review_id"]
-            params = {
-                "field_id": field_id,
-                "item_id": item_id,
-                "project_id": project_id,
-                "option_id": option_id,
-            }
-            result = github_gql_client.execute(
-                query_set_status_option, variable_values=params
-            )
-            ditto = len(f"{repo}#{number}") * "^"
-            # 90 is bright black (gray)
-            LOG.info(f"\u001b[90m{ditto}\u001b[0m moved to Status: In review")
-        LOG.change_indent(-1)
+        option_id = project_data[project]["status_in_review_id"]
+        status = "In review"
+        planned.append([repo, number, item_id, project, status, option_id])
+    if not args.dryrun:
+        failed += add_planned_items(
+            args, github_gql_client, project_data, planned
+        )
+
+    if failed:
+        LOG.error(
+            f"Failed to track {len(failed)} items: {', '.join(sorted(failed))}"
+        )
+        sys.exit(1)
 
 
 def main():
@@ -10,16 +10,14 @@ import argparse
 import sys
 import traceback
 
-# Third-party
-import yaml  # For converting .cc-metadata.yml to Python dictionary
-from github import GithubException, UnknownObjectException
-
 # First-party/Local
 import ccos.log
 from ccos import gh_utils
-from ccos.norm.get_labels import get_labels, get_required_label_groups
+from ccos.norm.branch_protections import update_branch_protections
+from ccos.norm.get_labels import get_labels, get_required_label_index
 from ccos.norm.set_labels import set_labels
 from ccos.norm.validate_issues import validate_issues
+from ccos.parallel import RateLimitBudget, RepoExecutor
 
 LOG = ccos.log.setup_logger()
 
@@ -60,103 +58,61 @@ def setup():
     ap.add_argument(
         "--skip-issues", action="store_true", help="skip issue labels check"
     )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of repositories to process concurrently (default: 1)",
+        metavar="N",
+    )
     args = ap.parse_args()
+    if args.workers < 1:
+        ap.error("--workers must be at least 1")
     return args
 
 
-def set_repo_labels(args, repos):
+def set_repo_labels(args, repos, executor):
     if args.skip_labels:
         return
     LOG.info("Syncing labels...")
-    set_labels(repos, *get_labels())
+    set_labels(repos, *get_labels(), executor=executor)
     LOG.success("done.")
 
 
-def validate_issue_labels(args, repos):
+def validate_issue_labels(args, repos, executor):
     if args.skip_issues:
         return
     LOG.info("Checking issues...")
-    required_label_groups = get_required_label_groups()
-    validate_issues(repos, required_label_groups)
+    validate_issues(repos, get_required_label_index(), executor=executor)
     LOG.success("done.")
 
 
-def is_engineering_project(repo):
-    try:
-        contents = repo.get_contents(".cc-metadata.yml")
-    except UnknownObjectException:
-        # Implies that there is no .cc-metadata.yml file in the repository
-        return False
-    contents = contents.decoded_content
-    metadata = yaml.safe_load(contents)
-    return metadata.get("engineering_project", False)
-
-
-def load_branch_protection_config():
-    with open("ccos/norm/branch_protections.yml", "r") as file:
-        config = yaml.safe_load(file)
-    return config
-
-
-def update_branch_protection(repo):
-    try:
-        default_branch = repo.get_branch(repo.default_branch)
-    except GithubException as e:
-        if e.data["message"] == "Branch not found":
-            LOG.warning(f"{repo.name}: skipping: default branch not found")
-            return
-        else:
-            raise
-    config = load_branch_protection_config()
-    exempt_repositories = config["EXEMPT_REPOSITORIES"]
-    required_status_check_map = config["REQUIRED_STATUS_CHECK_MAP"]
-
-    exempt_users = config.get("EXEMPT_USERS", {}).get(repo.name, [])
-
-    if repo.name not in exempt_repositories and is_engineering_project(repo):
-        LOG.info(f"{repo.name}: updating branch protections")
-        # The following empty *_bypass_pull_request_allowance arguments ensure
-        # the required bypass_pull_request_allowances API parameter is
-        # populated:
-        # https://docs.github.com/rest/branches/branch-protection#update-branch-protection
-        if repo.name in required_status_check_map:
-            default_branch.edit_protection(
-                required_approving_review_count=1,
-                user_push_restrictions=[],
-                contexts=required_status_check_map[repo.name],
-                users_bypass_pull_request_allowances=exempt_users,
-                teams_bypass_pull_request_allowances=[],
-                apps_bypass_pull_request_allowances=[],
-            )
-        else:
-            default_branch.edit_protection(
-                required_approving_review_count=1,
-                user_push_restrictions=[],
-                users_bypass_pull_request_allowances=exempt_users,
-                teams_bypass_pull_request_allowances=[],
-                apps_bypass_pull_request_allowances=[],
-            )
-    else:
-        LOG.info(f"{repo.name}: skipping: exempt")
-
-
-def update_branches(args, repos):
+def update_branches(args, repos, executor):
     if args.skip_branches:
         return
 
     LOG.info("Evaluting repositories for branch protections...")
-    for repo in repos:
-        update_branch_protection(repo)
+    update_branch_protections(repos, executor=executor)
     LOG.success("done.")
 
 
 def main():
     args = setup()
     LOG.info("Starting normalization")
-    repos = gh_utils.get_select_repos(args)
-    set_repo_labels(args, repos)
-    validate_issue_labels(args, repos)
-    update_branches(args, repos)
+    github_rest_client = gh_utils.setup_github_rest_client(
+        pool_size=args.workers
+    )
+    gh_org_cc = gh_utils.get_cc_organization(github_rest_client)
+    repos = gh_utils.get_select_repos(args, gh_org_cc)
+    executor = RepoExecutor(
+        workers=args.workers, budget=RateLimitBudget(github_rest_client)
+    )
+    set_repo_labels(args, repos, executor)
+    validate_issue_labels(args, repos, executor)
+    update_branches(args, repos, executor)
+    executor.log_summary()
+    if executor.failed:
+        raise ScriptError("Normalization failed for some repositories")
 
 
 if __name__ == "__main__":
@@ -40,6 +40,14 @@ def setup():
         default=DAILY_DATABAGS,
         help="the list of all databags to sync to CCOS",
     )
+    ap.add_argument(
+        "--clone",
+        action="store_true",
+        help=(
+            "push the databags with git from a sparse checkout instead of"
+            " through the GitHub API"
+        ),
+    )
     args = ap.parse_args()
     return args
 
@@ -48,17 +56,22 @@ def main():
     args = setup()
     github_client = gh_utils.setup_github_rest_client()
     gh_org_cc = gh_utils.get_cc_organization(github_client)
+    databags = {}
     if "repos" in args.databags:
-        LOG.info("updating repos.json")
-        push_data(get_repo_data(gh_org_cc), "repos.json")
+        LOG.info("generating repos.json")
+        databags["repos.json"] = get_repo_data(gh_org_cc)
         LOG.success("done.")
     if "community_team_members" in args.databags:
-        LOG.info("community_team_members.json")
+        LOG.info("generating community_team_members.json")
         asana_client = setup_asana_client()
         team_members = get_asana_team_members(asana_client)
         repo_names = get_repo_names(gh_org_cc)
         community_data = get_community_team_data(team_members, repo_names)
-        push_data(community_data, "community_team_members.json")
+        databags["community_team_members.json"] = community_data
+        LOG.success("done.")
+    if databags:
+        LOG.info(f"pushing {', '.join(sorted(databags))}")
+        push_data(databags, args.clone)
         LOG.success("done.")
 
 
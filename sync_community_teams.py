@@ -40,7 +40,24 @@ def setup():
         action="store_true",
         help="Debug mode: show differences instead of making changes",
     )
+    ap.add_argument(
+        "--clone",
+        action="store_true",
+        help=(
+            "clone each repository to check its CODEOWNERS file instead of"
+            " reading it through the GitHub API"
+        ),
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of repositories to check concurrently (default: 1)",
+        metavar="N",
+    )
     args = ap.parse_args()
+    if args.workers < 1:
+        ap.error("--workers must be at least 1")
     return args
 
 
@@ -52,11 +69,15 @@ def main():
     else:
         LOG.info("Synchronizing community teams")
     community_team_data = get_community_team_data()
+    permissions = None
     if not args.debug:
-        create_teams_for_data(community_team_data)
+        permissions = create_teams_for_data(community_team_data)
     else:
         LOG.debug("skipping team updates")
-    create_codeowners_for_data(args, community_team_data)
+    if not create_codeowners_for_data(
+        args, community_team_data, permissions=permissions
+    ):
+        raise ScriptError("CODEOWNERS sync failed for some repositories")
 
 
 if __name__ == "__main__":
@@ -9,18 +9,16 @@ and generate the required skills.json
 # Standard library
 import json
 import logging
-import os
 import sys
 import traceback
 
-# Third-party
-from github import Github
+# First-party/Local
+import ccos.log
+from ccos.snapshot import get_snapshot
 
+ccos.log.setup_logger()
 logger = logging.getLogger("sync_community_skills")
 
-GITHUB_ORGANIZATION = "creativecommons"
-GITHUB_TOKEN = os.environ["ADMIN_GITHUB_TOKEN"]
-
 
 class ScriptError(Exception):
     def __init__(self, message, code=None):
@@ -42,18 +40,18 @@ def generate_databag():
     }
     """
     print("Pulling from OS@CC...")
-    github_client = Github(GITHUB_TOKEN)
-    cc = github_client.get_organization(GITHUB_ORGANIZATION)
-    repos = list(cc.get_repos())
+    # The languages of all repos are part of the organization snapshot, so no
+    # request is made per repo
+    repos = get_snapshot()["repos"]
     if not repos:
         raise ScriptError(
-            "Unable to setup the Github Client to get the requested"
-            " Github organization and the repos of that organization"
+            "Unable to get the repos of the requested Github organization"
         )
-    repos.sort(key=lambda repo: repo.name)
     data = []
     for repo in repos:
-        data.append({"name": repo.name, "languages": repo.get_languages()})
+        data.append(
+            {"name": repo["name"], "languages": repo["ccos"]["languages"]}
+        )
     return data
 
 